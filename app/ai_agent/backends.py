@@ -0,0 +1,173 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import httpx
+
+from app.config.core.global_var import OLLAMA_BACKENDS, OLLAMA_HEALTH_PATH, OLLAMA_HEALTH_CHECK_INTERVAL, \
+    OLLAMA_HEALTH_FAILURE_THRESHOLD, OLLAMA_CIRCUIT_FAILURE_THRESHOLD, OLLAMA_CIRCUIT_RESET_TIMEOUT
+
+# Вес нового замера в скользящем среднем задержки
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class Backend:
+    """Один сервер Ollama: нагрузка, здоровье, состояние размыкателя цепи и задержка"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.healthy = True
+        self.health_failures = 0  # проваленных проверок здоровья подряд
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        # Идет пробный запрос к полуоткрытой цепи; остальные запросы к серверу не пускаем
+        self.probing = False
+        self.latency_ewma: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+
+    def available(self, now: float, reset_timeout: float) -> bool:
+        # После reset_timeout разомкнутая цепь пропускает один пробный запрос (half-open)
+        if not self.healthy:
+            return False
+        if self.opened_at is None:
+            return True
+        return not self.probing and now - self.opened_at >= reset_timeout
+
+    def record_success(self, latency: float):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (latency - self.latency_ewma)
+
+    def record_failure(self, threshold: int):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= threshold:
+            self.opened_at = time.monotonic()
+
+    def stats(self, now: float, reset_timeout: float) -> dict:
+        if self.opened_at is None:
+            circuit = "closed"
+        elif now - self.opened_at >= reset_timeout:
+            circuit = "half-open"
+        else:
+            circuit = "open"
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "health_failures": self.health_failures,
+            "circuit": circuit,
+            "probing": self.probing,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma_sec": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+        }
+
+
+class Attempt:
+    """Результат одной попытки; вызывающий код помечает неуспех, если сервер ответил ошибкой"""
+
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.failed = False
+
+
+class BackendRouter:
+    """Выбирает наименее загруженный здоровый сервер и переключается на следующий при ошибке соединения"""
+
+    def __init__(self, urls: List[str] = OLLAMA_BACKENDS, failure_threshold: int = OLLAMA_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = OLLAMA_CIRCUIT_RESET_TIMEOUT,
+                 health_check_interval: float = OLLAMA_HEALTH_CHECK_INTERVAL,
+                 health_failure_threshold: int = OLLAMA_HEALTH_FAILURE_THRESHOLD):
+        self.backends = [Backend(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.health_failure_threshold = health_failure_threshold
+        self.reset_timeout = reset_timeout
+        self.health_check_interval = health_check_interval
+        self._health_task: Optional[asyncio.Task] = None
+
+    def candidates(self, preferred: Optional[str] = None) -> List[Backend]:
+        """
+        Доступные серверы в порядке предпочтения: меньше запросов в работе, затем меньше задержка
+
+        Сервер без единого успешного ответа (задержка неизвестна) идет после остальных.
+        Сервер с адресом preferred, если он доступен, ставится первым независимо от нагрузки.
+        """
+        now = time.monotonic()
+        available = [b for b in self.backends if b.available(now, self.reset_timeout)]
+        return sorted(available, key=lambda b: (b.url != preferred, b.in_flight,
+                                                b.latency_ewma if b.latency_ewma is not None else float("inf")))
+
+    @asynccontextmanager
+    async def attempt(self, backend: Backend):
+        """
+        Учитывает запрос к серверу: нагрузку, задержку и ошибки транспорта
+
+        Запрос к полуоткрытой цепи — пробный; пока он выполняется, следующие попытки к этому
+        серверу сразу получают ConnectError, и вызывающий код переходит к другому серверу.
+        """
+        probe = backend.opened_at is not None
+        if probe:
+            if backend.probing:
+                raise httpx.ConnectError(f"{backend.url}: пробный запрос уже выполняется")
+            backend.probing = True
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.monotonic()
+        attempt = Attempt(backend)
+        try:
+            yield attempt
+        except httpx.TransportError:
+            backend.record_failure(self.failure_threshold)
+            raise
+        else:
+            if attempt.failed:
+                backend.record_failure(self.failure_threshold)
+            else:
+                backend.record_success(time.monotonic() - started)
+        finally:
+            backend.in_flight -= 1
+            if probe:
+                backend.probing = False
+
+    async def check_health(self, client: httpx.AsyncClient):
+        async def check(backend: Backend):
+            try:
+                response = await client.get(backend.url + OLLAMA_HEALTH_PATH, timeout=2.0)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            # Единичный сбой проверки (таймаут под нагрузкой) не выключает сервер на целый интервал:
+            # ошибки настоящих запросов и так размыкают его цепь
+            backend.health_failures = 0 if ok else backend.health_failures + 1
+            backend.healthy = backend.health_failures < self.health_failure_threshold
+            if ok and backend.opened_at is not None:
+                # Сервер снова отвечает — разрешаем пробный запрос, не дожидаясь reset_timeout
+                backend.opened_at = time.monotonic() - self.reset_timeout
+
+        await asyncio.gather(*(check(backend) for backend in self.backends))
+
+    def start_health_checks(self, client: httpx.AsyncClient):
+        async def loop():
+            while True:
+                await self.check_health(client)
+                await asyncio.sleep(self.health_check_interval)
+
+        if self._health_task is None and self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(loop())
+
+    async def stop_health_checks(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def stats(self) -> List[dict]:
+        now = time.monotonic()
+        return [backend.stats(now, self.reset_timeout) for backend in self.backends]
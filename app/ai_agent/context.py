@@ -0,0 +1,108 @@
+import math
+from typing import List, Dict, Tuple
+
+from app.config.core.global_var import CONTEXT_MAX_TOKENS, CONTEXT_SUMMARY_MAX_TOKENS, CONTEXT_SUMMARY_LINE_CHARS, \
+    CONTEXT_CHARS_PER_TOKEN
+from app.repositories.chat_repositories import get_chat_summary, get_chat_messages_after, save_chat_summary
+
+# Служебные токены, которые модель тратит на каждое сообщение (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ROLE_NAMES = {
+    "user": "Пользователь",
+    "assistant": "Ассистент",
+}
+
+
+def count_tokens(text: str) -> int:
+    """Оценивает число токенов в тексте (без токенизатора конкретной модели)"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CONTEXT_CHARS_PER_TOKEN)
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextWindow:
+    """Бюджет токенов для истории диалога и свертка старых реплик в краткое содержание"""
+
+    def __init__(self, max_tokens: int = CONTEXT_MAX_TOKENS, summary_max_tokens: int = CONTEXT_SUMMARY_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+
+    def fit(self, summary: str, messages: List[Dict], reserved_tokens: int) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Делит сообщения на те, что помещаются в окно, и те, что нужно свернуть
+
+        Args:
+            summary: Текущее краткое содержание
+            messages: Сообщения после краткого содержания, от старых к новым
+            reserved_tokens: Токены, уже занятые системным промптом и новым сообщением
+
+        Returns:
+            (помещающиеся сообщения, сообщения для свертки) — оба списка от старых к новым
+        """
+        budget = self.max_tokens - reserved_tokens - count_tokens(summary)
+        used = 0
+        split = len(messages)
+        # Идем от самых свежих реплик к старым, пока хватает бюджета
+        for index in range(len(messages) - 1, -1, -1):
+            used += message_tokens(messages[index])
+            if used > budget:
+                break
+            split = index
+        return messages[split:], messages[:split]
+
+    def fold(self, summary: str, messages: List[Dict]) -> str:
+        """Дописывает свернутые реплики в краткое содержание и обрезает его до бюджета"""
+        lines = summary.splitlines() if summary else []
+        for message in messages:
+            text = " ".join(message["content"].split())
+            if len(text) > CONTEXT_SUMMARY_LINE_CHARS:
+                text = text[:CONTEXT_SUMMARY_LINE_CHARS].rstrip() + "…"
+            lines.append(f"{ROLE_NAMES.get(message['role'], message['role'])}: {text}")
+
+        # Самые старые строки вытесняются первыми
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > self.summary_max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+context_window = ContextWindow()
+
+
+async def build_context(chat_id: int, system_prompt: str, message: str,
+                        window: ContextWindow = context_window) -> List[Dict[str, str]]:
+    """
+    Собирает историю для запроса к модели: краткое содержание + последние реплики в пределах бюджета
+
+    Загружаются только сообщения после последней свертки, а вытесненные из окна реплики
+    дописываются в сохраненное краткое содержание, поэтому стоимость хода не растет с длиной чата.
+    """
+    stored = await get_chat_summary(chat_id)
+    summary = stored["summary"] if stored else ""
+    after_id = stored["last_message_id"] if stored else 0
+
+    messages = await get_chat_messages_after(chat_id, after_id)
+    reserved = count_tokens(system_prompt) + count_tokens(message) + 2 * MESSAGE_OVERHEAD_TOKENS
+    kept, folded = window.fit(summary, messages, reserved)
+
+    last_folded_id = None
+    while folded:
+        summary = window.fold(summary, folded)
+        last_folded_id = folded[-1]["id"]
+        # Краткое содержание выросло — перепроверяем, что оставшиеся реплики помещаются
+        kept, folded = window.fit(summary, kept, reserved)
+    if last_folded_id is not None:
+        await save_chat_summary(chat_id, summary, last_folded_id)
+
+    history = []
+    if summary:
+        history.append({
+            "role": "system",
+            "content": f"Краткое содержание предыдущей части диалога:\n{summary}"
+        })
+    history.extend({"role": msg["role"], "content": msg["content"]} for msg in kept)
+    return history
@@ -1,44 +1,151 @@
-from typing import List, Dict
+import asyncio
+import importlib.util
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import List, Dict, Hashable, Optional, AsyncIterator, Tuple
 
 import httpx
 
-from app.config.core.global_var import OLLAMA_API_URL
-from app.util.reader import read_prompt
+from app.ai_agent.backends import BackendRouter
+from app.ai_agent.context import ROLE_NAMES
+from app.ai_agent.response_cache import ResponseCache
+from app.ai_agent.session_cache import ChatSession, make_session_cache
+from app.config.core.global_var import OLLAMA_CHAT_PATH, OLLAMA_GENERATE_PATH, OLLAMA_TIMEOUT, OLLAMA_CONNECT_TIMEOUT, \
+    OLLAMA_MAX_CONNECTIONS, OLLAMA_MAX_KEEPALIVE_CONNECTIONS, OLLAMA_KEEPALIVE_EXPIRY, OLLAMA_HTTP2, \
+    OLLAMA_MAX_CONCURRENT_REQUESTS, OLLAMA_DEFAULT_MODEL, OLLAMA_CHAT_TYPE_MODELS, OLLAMA_KEEP_ALIVE
+from app.util.metrics import record_span, record_generation
+from app.util.reader import PromptRegistry
 
 
 class MarketingAIBot:
     """Класс для взаимодействия с ИИ агентом для маркетинга через Ollama"""
 
-    async def get_response(self, message: str, history: List[Dict[str, str]], chat_type: str) -> str:
-        """
-        Получает ответ от локальной модели с учетом типа чата
+    def __init__(self, max_concurrent_requests: int = OLLAMA_MAX_CONCURRENT_REQUESTS):
+        self.max_concurrent_requests = max_concurrent_requests
+        self.prompts = PromptRegistry()
+        self.response_cache = ResponseCache()
+        # Сохраненный context чатов для /api/generate (None — всегда полный промпт через /api/chat)
+        self.sessions = make_session_cache()
+        self.router = BackendRouter()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._waiting = 0
+        self._requests_total = 0
+        self._errors_total = 0
 
-        Args:
-            message: Сообщение пользователя
-            history: История диалialogа
-            chat_type: Тип чата (анализ, стратегия, контент, реклама и т.д.)
+    async def start(self):
+        """Загружает промпты и создает долгоживущий HTTP-клиент (вызывается при старте приложения)"""
+        if self._client is not None:
+            return
+        self.prompts.load()
+        self._client = httpx.AsyncClient(
+            http2=OLLAMA_HTTP2 and importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        self.router.start_health_checks(self._client)
 
-        Returns:
-            Ответ от модели
-        """
-        # Формируем контекст диалога
-        messages = []
+    async def close(self):
+        """Закрывает HTTP-клиент и все соединения пула (вызывается при остановке приложения)"""
+        if self._client is not None:
+            await self.router.stop_health_checks()
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
 
-        # Добавляем системное сообщение в зависимости от типа чата
-        system_prompts = {
-            "analysis": read_prompt("analysis"),
-            "strategy": read_prompt("strategy"),
-            "content": read_prompt("content"),
-            "ads": read_prompt("ads"),
-            "seo": read_prompt("seo"),
-            "social": read_prompt("social")
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Для использования вне приложения (скрипты) клиент создается при первом обращении
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    @asynccontextmanager
+    async def _inference_slot(self):
+        # Ограничиваем число одновременных запросов, чтобы всплеск трафика не перегрузил сервер модели
+        self._waiting += 1
+        started = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        record_span("model.wait_slot", time.perf_counter() - started)
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    def pool_stats(self) -> Dict[str, object]:
+        """Статистика пула соединений и ограничителя параллельных запросов"""
+        stats = {
+            "started": self._client is not None,
+            "max_concurrent_requests": self.max_concurrent_requests,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "requests_total": self._requests_total,
+            "errors_total": self._errors_total,
         }
+        # httpx не предоставляет публичного API для состояния пула, поэтому смотрим в httpcore
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is not None:
+            stats["connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+            stats["http2"] = getattr(pool, "_http2", False)
+        stats["backends"] = self.router.stats()
+        return stats
 
-        system_message = system_prompts.get(chat_type, read_prompt("default"))
+    async def _post(self, client: httpx.AsyncClient, path: str, payload: dict,
+                    preferred: Optional[str] = None) -> Tuple[httpx.Response, str]:
+        # Пробуем серверы по порядку предпочтения (preferred — сервер с сессией чата, пока он доступен);
+        # на следующий переключаемся, только если не удалось соединиться. Возвращаем ответ и адрес сервера
+        last_error = None
+        for backend in self.router.candidates(preferred):
+            try:
+                async with self.router.attempt(backend) as attempt:
+                    response = await client.post(backend.url + path, json=payload)
+                    attempt.failed = response.status_code >= 500
+                return response, backend.url
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                last_error = e
+        raise httpx.ConnectError(str(last_error or "Нет доступных серверов модели"))
 
+    @asynccontextmanager
+    async def _stream(self, client: httpx.AsyncClient, path: str, payload: dict, preferred: Optional[str] = None):
+        # То же, что _post, но для потокового ответа: переключение возможно только до получения ответа
+        last_error = None
+        for backend in self.router.candidates(preferred):
+            opened = False
+            try:
+                async with self.router.attempt(backend) as attempt:
+                    async with client.stream("POST", backend.url + path, json=payload) as response:
+                        opened = True
+                        attempt.failed = response.status_code >= 500
+                        yield response, backend.url
+                return
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if opened:
+                    raise
+                last_error = e
+        raise httpx.ConnectError(str(last_error or "Нет доступных серверов модели"))
+
+    def _build_payload(self, message: str, history: List[Dict[str, str]], system_prompt: str, model: str,
+                       stream: bool) -> dict:
+        # Формируем контекст диалога
+        messages = []
+
+        # Добавляем системное сообщение в зависимости от типа чата
         messages.append({
             "role": "system",
-            "content": system_message
+            "content": system_prompt
         })
 
         # Добавляем историю диалога
@@ -55,27 +162,225 @@ class MarketingAIBot:
         })
 
         # Параметры запроса к Ollama
-        payload = {
-            "model": "llama2",  # Вы можете изменить на другую модель
+        return {
+            "model": model,
             "messages": messages,
-            "stream": False
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE
         }
 
+    @staticmethod
+    def _build_generate_payload(message: str, history: List[Dict[str, str]], system_prompt: str, model: str,
+                                stream: bool, session: Optional[ChatSession]) -> dict:
+        payload = {"model": model, "stream": stream, "keep_alive": OLLAMA_KEEP_ALIVE}
+        if session is not None:
+            # Системный промпт и история уже есть в context — модель обрабатывает только новое сообщение
+            payload["context"] = session.context.tolist()
+            payload["prompt"] = message
+            return payload
+
+        # Полный промпт: /api/generate принимает одно сообщение, поэтому история передается текстом,
+        # а краткое содержание старой части диалога дописывается к системному промпту
+        system = [system_prompt] + [msg["content"] for msg in history if msg["role"] == "system"]
+        turns = [f"{ROLE_NAMES.get(msg['role'], msg['role'])}: {msg['content']}"
+                 for msg in history if msg["role"] != "system"]
+        payload["system"] = "\n\n".join(system)
+        if turns:
+            payload["prompt"] = "Диалог до этого момента:\n\n" + "\n\n".join(turns) + \
+                                f"\n\nНовое сообщение пользователя:\n{message}"
+        else:
+            payload["prompt"] = message
+        return payload
+
+    def _build_request(self, message: str, history: List[Dict[str, str]], system_prompt: str, model: str,
+                       stream: bool, session_key: Optional[Hashable]) -> Tuple[str, dict, Optional[str]]:
+        """
+        Путь и тело запроса: /api/chat или, если для чата ведется сессия, /api/generate
+
+        Третий элемент — сервер, которому лучше отправить запрос: тот, что вернул context сессии.
+        """
+        if session_key is None or self.sessions is None:
+            return OLLAMA_CHAT_PATH, self._build_payload(message, history, system_prompt, model, stream), None
+        session = self.sessions.get(session_key, model, system_prompt, history)
+        payload = self._build_generate_payload(message, history, system_prompt, model, stream, session)
+        return OLLAMA_GENERATE_PATH, payload, session.backend if session is not None else None
+
+    def _full_prompt_retry(self, path: str, payload: dict, message: str, history: List[Dict[str, str]],
+                           system_prompt: str, session_key: Optional[Hashable]) -> Optional[dict]:
+        # Сервер не принял сохраненный context (модель выгружена с другим окном, сменилась версия и т.п.) —
+        # сессия сбрасывается, и ход повторяется с полным промптом
+        if path != OLLAMA_GENERATE_PATH or "context" not in payload:
+            return None
+        self.sessions.delete(session_key)
+        return self._build_generate_payload(message, history, system_prompt, payload["model"], payload["stream"],
+                                            None)
+
+    def _save_session(self, session_key: Optional[Hashable], path: str, payload: dict, system_prompt: str,
+                      message: str, response: str, final: dict, backend: str):
+        if path == OLLAMA_GENERATE_PATH and final.get("context"):
+            self.sessions.put(session_key, payload["model"], system_prompt, message, response, final["context"],
+                              backend)
+
+    @staticmethod
+    def _response_text(data: dict) -> str:
+        # /api/generate отдает текст в response, /api/chat — в message.content
+        if "response" in data:
+            return data["response"]
+        return data.get("message", {}).get("content", "")
+
+    @staticmethod
+    def _record_generation(model: str, final: dict, elapsed: float, time_to_first_token: Optional[float] = None,
+                           chunks: int = 0):
+        # Ollama сообщает в последнем ответе число токенов и время генерации (eval_duration, нс);
+        # если этих полей нет, оцениваем по числу фрагментов и собственным замерам
+        tokens = final.get("eval_count") or chunks
+        eval_duration = final.get("eval_duration")
+        if eval_duration:
+            generation_time = eval_duration / 1e9
+            if time_to_first_token is None:
+                time_to_first_token = max(0.0, elapsed - generation_time)
+        else:
+            generation_time = elapsed - (time_to_first_token or 0.0)
+        record_span("model.request", elapsed)
+        record_generation(model, time_to_first_token, tokens, generation_time)
+
+    async def _cached_response(self, model: str, system_prompt: str, history: List[Dict[str, str]], message: str,
+                               chat_type: str):
+        # Возвращает (ключ кэша, закэшированный ответ); ключ None, если кэш для типа чата выключен
+        if not self.response_cache.enabled_for(chat_type):
+            return None, None
+        key = self.response_cache.make_key(model, system_prompt, history, message)
+        return key, await self.response_cache.get(key)
+
+    async def get_response(self, message: str, history: List[Dict[str, str]], chat_type: str,
+                           session_key: Optional[Hashable] = None) -> str:
+        """
+        Получает ответ от локальной модели с учетом типа чата
+
+        Args:
+            message: Сообщение пользователя
+            history: История диалialogа
+            chat_type: Тип чата (анализ, стратегия, контент, реклама и т.д.)
+            session_key: Ключ сессии (id чата); если задан, модель продолжает сохраненный context
+
+        Returns:
+            Ответ от модели
+        """
+        system_prompt = self.prompts.get(chat_type)
+        model = OLLAMA_CHAT_TYPE_MODELS.get(chat_type, OLLAMA_DEFAULT_MODEL)
+
+        cache_key, cached = await self._cached_response(model, system_prompt, history, message, chat_type)
+        if cached is not None:
+            return cached
+
+        path, payload, preferred = self._build_request(message, history, system_prompt, model, False, session_key)
+        client = await self._get_client()
+        self._requests_total += 1
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    OLLAMA_API_URL,
-                    json=payload,
-                    timeout=60.0  # Увеличенный таймаут для локальных моделей
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    return data["message"]["content"]
-                else:
-                    return f"Ошибка локальной модели: {response.status_code} - {response.text}"
+            async with self._inference_slot():
+                started = time.perf_counter()
+                response, backend = await self._post(client, path, payload, preferred)
+                if response.status_code != 200:
+                    retry = self._full_prompt_retry(path, payload, message, history, system_prompt, session_key)
+                    if retry is not None:
+                        payload = retry
+                        response, backend = await self._post(client, path, payload, preferred)
+                elapsed = time.perf_counter() - started
+
+            if response.status_code == 200:
+                data = response.json()
+                content = self._response_text(data)
+                self._record_generation(model, data, elapsed)
+                self._save_session(session_key, path, payload, system_prompt, message, content, data, backend)
+                if cache_key is not None:
+                    await self.response_cache.set(cache_key, content)
+                return content
+            else:
+                self._errors_total += 1
+                return f"Ошибка локальной модели: {response.status_code} - {response.text}"
 
         except httpx.ConnectError:
+            self._errors_total += 1
             return "Ошибка: Не удалось подключиться к локальной модели. Убедитесь, что Ollama запущен."
         except Exception as e:
+            self._errors_total += 1
             return f"Ошибка при обращении к локальной модели: {str(e)}"
+
+    async def stream_response(self, message: str, history: List[Dict[str, str]], chat_type: str,
+                              session_key: Optional[Hashable] = None) -> AsyncIterator[str]:
+        """
+        Получает ответ от локальной модели по частям, по мере генерации токенов
+
+        Args:
+            message: Сообщение пользователя
+            history: История диалога
+            chat_type: Тип чата
+            session_key: Ключ сессии (id чата); если задан, модель продолжает сохраненный context
+
+        Returns:
+            Асинхронный итератор фрагментов ответа. Ошибки отдаются последним фрагментом,
+            так же как get_response возвращает их текстом
+        """
+        system_prompt = self.prompts.get(chat_type)
+        model = OLLAMA_CHAT_TYPE_MODELS.get(chat_type, OLLAMA_DEFAULT_MODEL)
+
+        cache_key, cached = await self._cached_response(model, system_prompt, history, message, chat_type)
+        if cached is not None:
+            yield cached
+            return
+
+        path, payload, preferred = self._build_request(message, history, system_prompt, model, True, session_key)
+        client = await self._get_client()
+        self._requests_total += 1
+        try:
+            async with self._inference_slot():
+                started = time.perf_counter()
+                first_token_at = None
+                while True:
+                    async with self._stream(client, path, payload, preferred) as (response, backend):
+                        if response.status_code != 200:
+                            retry = self._full_prompt_retry(path, payload, message, history, system_prompt,
+                                                            session_key)
+                            if retry is not None:
+                                payload = retry
+                                continue
+                            self._errors_total += 1
+                            body = await response.aread()
+                            yield f"Ошибка локальной модели: {response.status_code} - {body.decode(errors='replace')}"
+                            return
+
+                        # Ollama отдает NDJSON: одна JSON-строка на каждый фрагмент ответа
+                        parts = []
+                        async for line in response.aiter_lines():
+                            if not line:
+                                continue
+                            data = json.loads(line)
+                            if "error" in data:
+                                self._errors_total += 1
+                                yield f"Ошибка локальной модели: {data['error']}"
+                                return
+                            token = self._response_text(data)
+                            if token:
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                parts.append(token)
+                                yield token
+                            if data.get("done"):
+                                self._record_generation(
+                                    model, data, time.perf_counter() - started,
+                                    first_token_at - started if first_token_at is not None else None, len(parts)
+                                )
+                                content = "".join(parts)
+                                self._save_session(session_key, path, payload, system_prompt, message, content,
+                                                   data, backend)
+                                if cache_key is not None:
+                                    await self.response_cache.set(cache_key, content)
+                                return
+                        return
+
+        except httpx.ConnectError:
+            self._errors_total += 1
+            yield "Ошибка: Не удалось подключиться к локальной модели. Убедитесь, что Ollama запущен."
+        except Exception as e:
+            self._errors_total += 1
+            yield f"Ошибка при обращении к локальной модели: {str(e)}"
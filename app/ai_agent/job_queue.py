@@ -0,0 +1,270 @@
+import asyncio
+import contextvars
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from app.config.core.global_var import INFERENCE_WORKERS, INFERENCE_JOB_RESULT_TTL, INFERENCE_JOB_POLL_INTERVAL
+
+logger = logging.getLogger("crm.jobs")
+
+# Пространство имен заданий в общем хранилище (SqliteStateStore)
+JOBS_NAMESPACE = "inference_jobs"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class InferenceJob:
+    id: str
+    user_id: int
+    chat: dict
+    message: str
+    status: str = QUEUED
+    result: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    # Контекст отправителя: обработчик выполняется в нем, и его спаны попадают в трассу исходного запроса
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+    # Потоковое задание: обработчик передает токены через push, подписчики читают их через tokens_stream
+    stream: bool = False
+    tokens: List[str] = field(default_factory=list)
+    message_id: Optional[int] = None
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    def push(self, token: str):
+        self.tokens.append(token)
+        self.notify()
+
+    def notify(self):
+        # Будим всех подписчиков; следующие изменения они ждут на новом событии
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def tokens_stream(self) -> AsyncIterator[str]:
+        """Токены ответа с начала генерации и далее по мере поступления; заканчивается вместе с заданием"""
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.tokens):
+                sent += 1
+                yield self.tokens[sent - 1]
+            if self.done.is_set():
+                # Объединенное с обычным заданием потоковое получает ответ целиком
+                if not sent and self.result:
+                    yield self.result
+                return
+            await changed.wait()
+
+    @property
+    def coalesce_key(self) -> Tuple[int, str]:
+        return self.chat["id"], " ".join(self.message.split())
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "chat_id": self.chat["id"],
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def to_record(self) -> dict:
+        # Запись для общего хранилища: по user_id другой воркер проверяет владельца задания
+        return {**self.to_dict(), "user_id": self.user_id}
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class InferenceJobQueue:
+    """
+    Очередь запросов к модели с честным планированием между пользователями
+
+    У каждого пользователя своя очередь заданий; воркеры берут задания по кругу (round-robin),
+    поэтому один активный пользователь не задерживает остальных. Повторная отправка того же
+    сообщения в тот же чат, пока предыдущее еще не обработано, возвращает уже существующее задание.
+
+    Задания выполняются в процессе, который их принял. Если передано общее хранилище (store),
+    состояние и результат каждого задания публикуются в нем, и опросить задание можно через
+    любой воркер (см. lookup); без него запросы к /jobs должны приходить в тот же процесс.
+    """
+
+    def __init__(self, handler: Callable[[InferenceJob], Awaitable[str]], workers: int = INFERENCE_WORKERS,
+                 result_ttl: float = INFERENCE_JOB_RESULT_TTL, store=None):
+        self.handler = handler
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.store = store
+        self._queues: "OrderedDict[int, Deque[InferenceJob]]" = OrderedDict()
+        self._jobs: Dict[str, InferenceJob] = {}
+        self._active: Dict[Tuple[int, str], InferenceJob] = {}
+        self._condition: Optional[asyncio.Condition] = None
+        self._tasks = []
+        self._depth = 0
+        self._running = 0
+        self._submitted = 0
+        self._coalesced = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_times: Deque[float] = deque(maxlen=1000)
+        self._service_times: Deque[float] = deque(maxlen=1000)
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._condition = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Задания, до которых очередь не дошла, завершаем, чтобы ожидающие их запросы не зависли
+        cancelled = [job for queue in self._queues.values() for job in queue]
+        self._queues.clear()
+        self._depth = 0
+        for job in cancelled:
+            job.status = FAILED
+            job.error = "Задание отменено"
+            self._active.pop(job.coalesce_key, None)
+            job.done.set()
+            job.notify()
+            await self._publish(job)
+
+    async def submit(self, user_id: int, chat: dict, message: str, stream: bool = False) -> InferenceJob:
+        """
+        Ставит сообщение в очередь и сразу возвращает задание (или уже существующее такое же)
+
+        stream=True — обработчик отдает токены по мере генерации (InferenceJob.tokens_stream).
+        """
+        if not self._tasks:
+            await self.start()
+        self._prune_finished()
+        job = InferenceJob(id=uuid.uuid4().hex, user_id=user_id, chat=chat, message=message, stream=stream)
+
+        existing = self._active.get(job.coalesce_key)
+        if existing is not None:
+            self._coalesced += 1
+            return existing
+
+        self._jobs[job.id] = job
+        self._active[job.coalesce_key] = job
+        self._submitted += 1
+        # Публикуем до постановки в очередь, чтобы запись "queued" не перезаписала более позднюю
+        await self._publish(job)
+        async with self._condition:
+            self._queues.setdefault(user_id, deque()).append(job)
+            self._depth += 1
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[InferenceJob]:
+        return self._jobs.get(job_id)
+
+    async def lookup(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        """
+        Запись задания, принятого другим воркером, из общего хранилища
+
+        При wait > 0 опрашивает хранилище, пока задание не завершится или не истечет wait секунд.
+        """
+        if self.store is None:
+            return None
+        deadline = time.monotonic() + wait
+        while True:
+            record = await asyncio.to_thread(self.store.get, JOBS_NAMESPACE, job_id)
+            remaining = deadline - time.monotonic()
+            if record is None or record["status"] in (DONE, FAILED) or remaining <= 0:
+                return record
+            await asyncio.sleep(min(INFERENCE_JOB_POLL_INTERVAL, remaining))
+
+    async def _publish(self, job: InferenceJob):
+        if self.store is None:
+            return
+        # Записи одного задания идут последовательно (submit, старт, завершение), поэтому не обгоняют друг друга
+        if not await asyncio.to_thread(self.store.put, JOBS_NAMESPACE, job.id, job.to_record(), self.result_ttl):
+            logger.warning("Состояние задания %s не опубликовано", job.id)
+
+    async def wait(self, job: InferenceJob, timeout: Optional[float] = None) -> InferenceJob:
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job
+
+    async def _next_job(self) -> InferenceJob:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._depth > 0)
+            # Берем задание у пользователя, дольше всех ожидающего своей очереди, и переносим его в конец
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._depth -= 1
+            return job
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            job.status = RUNNING
+            job.started_at = time.monotonic()
+            self._wait_times.append(job.started_at - job.created_at)
+            self._running += 1
+            try:
+                await self._publish(job)
+                job.result = await asyncio.create_task(self.handler(job), context=job.context)
+                job.status = DONE
+                self._completed += 1
+            except asyncio.CancelledError:
+                job.status = FAILED
+                job.error = "Задание отменено"
+                raise
+            except Exception as e:
+                job.status = FAILED
+                job.error = str(e)
+                self._failed += 1
+            finally:
+                self._running -= 1
+                job.finished_at = time.monotonic()
+                self._service_times.append(job.finished_at - job.started_at)
+                self._active.pop(job.coalesce_key, None)
+                job.done.set()
+                job.notify()
+                await self._publish(job)
+
+    def _prune_finished(self):
+        # Результаты хранятся result_ttl секунд, чтобы клиент успел их забрать
+        deadline = time.monotonic() - self.result_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < deadline]:
+            del self._jobs[job_id]
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": self._depth,
+            "running": self._running,
+            "users_waiting": len(self._queues),
+            "submitted_total": self._submitted,
+            "coalesced_total": self._coalesced,
+            "completed_total": self._completed,
+            "failed_total": self._failed,
+            "wait_time_p50_sec": round(_percentile(self._wait_times, 50), 4),
+            "wait_time_p95_sec": round(_percentile(self._wait_times, 95), 4),
+            "service_time_p50_sec": round(_percentile(self._service_times, 50), 4),
+            "service_time_p95_sec": round(_percentile(self._service_times, 95), 4),
+        }
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import time
+from typing import List, Dict, Optional
+
+from app.config.core.global_var import RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_CHAT_TYPES, RESPONSE_CACHE_SIZE, \
+    RESPONSE_CACHE_TTL, RESPONSE_CACHE_PERSISTENT, RESPONSE_CACHE_CONTEXT_MESSAGES
+from app.repositories.response_cache_repositories import get_cached_response, save_cached_response, \
+    delete_expired_responses
+from app.util.cache import TTLCache
+
+# Как часто (в записях) удалять устаревшие строки постоянного уровня
+PRUNE_EVERY = 100
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class ResponseCache:
+    """
+    Кэш ответов модели: LRU в памяти и, по желанию, постоянный уровень в SQLite
+
+    Ключ — хэш модели, системного промпта, нескольких последних сообщений истории и самого
+    вопроса (после нормализации регистра и пробелов), поэтому одинаковые первые вопросы
+    в новых чатах одного типа обслуживаются без обращения к модели.
+    """
+
+    def __init__(self, enabled: bool = RESPONSE_CACHE_ENABLED, chat_types=RESPONSE_CACHE_CHAT_TYPES,
+                 maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 persistent: bool = RESPONSE_CACHE_PERSISTENT,
+                 context_messages: int = RESPONSE_CACHE_CONTEXT_MESSAGES):
+        self.enabled = enabled
+        self.chat_types = frozenset(chat_types)
+        self.ttl = ttl
+        self.persistent = persistent
+        self.context_messages = context_messages
+        self._memory = TTLCache(maxsize, ttl)
+        self._persistent_hits = 0
+        self._writes = 0
+
+    def enabled_for(self, chat_type: str) -> bool:
+        return self.enabled and chat_type in self.chat_types
+
+    def make_key(self, model: str, system_prompt: str, history: List[Dict[str, str]], message: str) -> str:
+        recent = history[-self.context_messages:] if self.context_messages else []
+        material = json.dumps([
+            model,
+            normalize(system_prompt),
+            [[msg["role"], normalize(msg["content"])] for msg in recent],
+            normalize(message),
+        ], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self._memory.get(key)
+        if response is None and self.persistent:
+            response = await get_cached_response(key, time.time() - self.ttl)
+            if response is not None:
+                self._persistent_hits += 1
+                self._memory.set(key, response)
+        return response
+
+    async def set(self, key: str, response: str):
+        self._memory.set(key, response)
+        if self.persistent:
+            now = time.time()
+            await save_cached_response(key, response, now)
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                await delete_expired_responses(now - self.ttl)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "chat_types": sorted(self.chat_types),
+            "persistent": self.persistent,
+            "persistent_hits": self._persistent_hits,
+            "memory": self._memory.stats(),
+        }
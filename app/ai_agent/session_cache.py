@@ -0,0 +1,128 @@
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Sequence
+
+from app.config.core.global_var import OLLAMA_SESSIONS_ENABLED, OLLAMA_SESSION_CACHE_BYTES, OLLAMA_SESSION_MAX_TOKENS
+
+# Память на запись помимо массива токенов: объекты, отпечатки, ключ
+SESSION_OVERHEAD_BYTES = 512
+
+
+def fingerprint(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def turn_fingerprint(history: List[Dict[str, str]]) -> Optional[str]:
+    # Отпечаток двух последних реплик истории (вопрос и ответ предыдущего хода)
+    if len(history) < 2:
+        return None
+    return fingerprint(*(part for msg in history[-2:] for part in (msg["role"], msg["content"])))
+
+
+@dataclass
+class ChatSession:
+    """Состояние диалога в модели: токены context из ответа /api/generate и то, чем они заканчиваются"""
+    model: str
+    system_fingerprint: str
+    turn_fingerprint: str
+    context: array
+    # Сервер, вернувший context: у него модель загружена с этим диалогом, и префикс не пересчитывается
+    backend: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return self.context.itemsize * len(self.context) + SESSION_OVERHEAD_BYTES
+
+
+class SessionCache:
+    """
+    LRU сессий чатов, ограниченный суммарным объемом сохраненных токенов
+
+    Сессия годится для следующего хода, только если модель и системный промпт не менялись,
+    а история заканчивается тем же вопросом и ответом, что и context. Иначе (чат очищен,
+    ход обслужен другим воркером или кэшем ответов) она считается устаревшей, и вызывающий
+    код отправляет полный промпт.
+    """
+
+    def __init__(self, max_bytes: int = OLLAMA_SESSION_CACHE_BYTES, max_tokens: int = OLLAMA_SESSION_MAX_TOKENS):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self._data: "OrderedDict[Hashable, ChatSession]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.overflows = 0
+
+    def get(self, key: Hashable, model: str, system_prompt: str,
+            history: List[Dict[str, str]]) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._data.get(key)
+            if session is None:
+                self.misses += 1
+                return None
+            if (session.model != model or session.system_fingerprint != fingerprint(system_prompt)
+                    or session.turn_fingerprint != turn_fingerprint(history)):
+                self._remove(key)
+                self.stale += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return session
+
+    def put(self, key: Hashable, model: str, system_prompt: str, message: str, response: str,
+            context: Sequence[int], backend: Optional[str] = None):
+        """Запоминает context после хода message -> response, полученный от сервера backend"""
+        with self._lock:
+            self._remove(key)
+            # Длинный context все равно обрежется окном модели; следующий ход начнется с полного
+            # промпта, где старые реплики уже свернуты в краткое содержание
+            if len(context) > self.max_tokens:
+                self.overflows += 1
+                return
+            session = ChatSession(
+                model=model,
+                system_fingerprint=fingerprint(system_prompt),
+                turn_fingerprint=fingerprint("user", message, "assistant", response),
+                context=array("i", context),
+                backend=backend
+            )
+            self._data[key] = session
+            self._bytes += session.size
+            while self._bytes > self.max_bytes and self._data:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: Hashable):
+        session = self._data.pop(key, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.stale
+        return {
+            "sessions": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "overflows": self.overflows,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def make_session_cache() -> Optional[SessionCache]:
+    """Кэш сессий или None, если повторное использование context выключено"""
+    return SessionCache() if OLLAMA_SESSIONS_ENABLED else None
@@ -0,0 +1,101 @@
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict
+
+from fastapi import FastAPI
+from starlette.responses import RedirectResponse
+
+from app.config.core.global_var import DATABASE_MIGRATE_ON_STARTUP
+from app.util.http_compression import CompressionMiddleware
+from app.util.metrics import MetricsMiddleware
+
+logger = logging.getLogger("crm.startup")
+
+
+@contextmanager
+def _phase(timings: Dict[str, float], name: str):
+    # Длительность этапа запуска в миллисекундах; видна в логе и на /stats/startup
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def home_page():
+    return RedirectResponse(url="/login")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Ресурсы (схема БД, HTTP-клиент к Ollama, воркеры очереди) создаются здесь, а не при импорте модулей
+    from app.config.core.depends import bot, job_queue
+    from app.config.database.db_config import init_db
+    from app.config.database.db_executor import shutdown_executors
+    from app.repositories.chat_repositories import message_writer
+
+    timings = app.state.startup_timings
+    started = time.perf_counter()
+    if DATABASE_MIGRATE_ON_STARTUP:
+        with _phase(timings, "migrations"):
+            app.state.applied_migrations = init_db()
+    with _phase(timings, "bot"):
+        # Один HTTP-клиент к Ollama на все время жизни приложения
+        await bot.start()
+    with _phase(timings, "job_queue"):
+        await job_queue.start()
+    timings["startup"] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info("Запуск: %s", ", ".join(f"{name} {ms:.1f} мс" for name, ms in timings.items()))
+
+    yield
+
+    await job_queue.stop()
+    await bot.close()
+    # Дописываем буфер сообщений и дожидаемся незавершенных записей в БД
+    await message_writer.flush()
+    shutdown_executors()
+
+
+def create_app() -> FastAPI:
+    """
+    Собирает приложение: middleware, статические файлы и контроллеры
+
+    Тяжелые зависимости (jose, passlib, Jinja2) импортируются при первом использовании,
+    а БД и клиент модели готовятся в lifespan, поэтому импорт модуля почти ничего не стоит.
+    """
+    timings: Dict[str, float] = {}
+
+    app = FastAPI(
+        title="Marketing AI Agent CRM",
+        description="Веб-приложение с ИИ агентом для маркетинга",
+        version="1.0.0",
+        lifespan=lifespan
+    )
+    app.state.startup_timings = timings
+    app.state.applied_migrations = []
+
+    # Сжатие ответов (gzip/brotli); добавлено первым, поэтому метрики учитывают и время сжатия
+    app.add_middleware(CompressionMiddleware)
+    # Гистограммы задержки по маршрутам и трасса спанов каждого запроса (см. /metrics)
+    app.add_middleware(MetricsMiddleware)
+
+    with _phase(timings, "routers"):
+        from app.config.core.config import static_files
+        from app.controllers.chat import router as chat_router
+        from app.controllers.authorization.login import router as login_router
+        from app.controllers.authorization.logout import router as logout_router
+        from app.controllers.authorization.register import router as register_router
+        from app.controllers.monitoring import router as monitoring_router
+        from app.controllers.metrics import router as metrics_router
+
+        app.mount("/static", static_files, name="static")
+        app.include_router(chat_router)
+        app.include_router(login_router)
+        app.include_router(logout_router)
+        app.include_router(register_router)
+        app.include_router(monitoring_router)
+        app.include_router(metrics_router)
+        app.add_api_route("/", home_page, methods=["GET"])
+
+    return app
@@ -1,19 +1,54 @@
-from fastapi import FastAPI
-from passlib.context import CryptContext
-from starlette.staticfiles import StaticFiles
-from starlette.templating import Jinja2Templates
+import functools
+import threading
 
-# Создаем экземпляр FastAPI приложения
-app = FastAPI(
-    title="Marketing AI Agent CRM",
-    description="Веб-приложение с ИИ агентом для маркетинга",
-    version="1.0.0"
-)
+from app.config.core.global_var import BCRYPT_ROUNDS
+from app.util.metrics import span
+from app.util.static_files import HashedStaticFiles
+
+# Статические файлы (CSS, JS); в шаблонах адреса берутся через static_url() — с хэшем содержимого.
+# Само приложение собирается в app.config.core.application.create_app()
+static_files = HashedStaticFiles()
+
+
+class TimedTemplates:
+    """
+    Шаблоны HTML: Jinja2 импортируется и окружение создается при первом рендере, а не при старте
+
+    Шаблоны рендерятся при создании ответа, поэтому спан оборачивает TemplateResponse.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    from starlette.templating import Jinja2Templates
+
+                    templates = Jinja2Templates(directory=self.directory)
+                    templates.env.globals["static_url"] = static_files.url
+                    self._templates = templates
+        return self._templates
+
+    @property
+    def env(self):
+        return self._get().env
+
+    def TemplateResponse(self, *args, **kwargs):
+        with span("template.render"):
+            return self._get().TemplateResponse(*args, **kwargs)
 
-# Подключаем статические файлы (CSS, JS)
-app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Подключаем шаблоны HTML
-templates = Jinja2Templates(directory="templates")
+templates = TimedTemplates(directory="templates")
+
+
+@functools.lru_cache(maxsize=None)
+def get_pwd_context():
+    """Контекст passlib создается при первом хэшировании пароля"""
+    from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
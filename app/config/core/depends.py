@@ -1,8 +1,34 @@
-from app.ai_agent.interaction import MarketingAIBot
-from app.config.database.db_config import init_db
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
 
-# Инициализация БД
-init_db()
+from app.ai_agent.interaction import MarketingAIBot
+from app.ai_agent.job_queue import InferenceJob, InferenceJobQueue
+from app.config.core.global_var import STATS_TOKEN
+from app.services.chat_service import run_chat_turn, stream_chat_turn
+from app.util.shared_state import get_store
 
-# Создаем экземпляр ИИ агента
+# Создаем экземпляр ИИ агента (HTTP-клиент и промпты готовятся в lifespan приложения, см. bot.start)
 bot = MarketingAIBot()
+
+
+async def run_job(job: InferenceJob) -> str:
+    if not job.stream:
+        return await run_chat_turn(bot, job.chat, job.message)
+    bot_response, job.message_id = await stream_chat_turn(bot, job.chat, job.message, job.push)
+    return bot_response
+
+
+# Очередь заданий к ИИ агенту: честное распределение между пользователями и объединение дублей
+# (и для обычных, и для потоковых ходов); при SHARED_STATE_BACKEND=sqlite состояние заданий видно всем воркерам
+job_queue = InferenceJobQueue(run_job, store=get_store())
+
+
+async def require_stats_access(authorization: Optional[str] = Header(None)):
+    # Служебная статистика и метрики раскрывают нагрузку и адреса серверов модели — только по токену
+    if not STATS_TOKEN:
+        raise HTTPException(status_code=404)
+    expected = f"Bearer {STATS_TOKEN}".encode()
+    if not secrets.compare_digest((authorization or "").encode(), expected):
+        raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Bearer"})
@@ -1,7 +1,163 @@
+import os
+
 # Настройки безопасности
 SECRET_KEY = "your-secret-key-here-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Настройки для Ollama
-OLLAMA_API_URL = "http://localhost:11434/api/chat"
+# Настройки для Ollama: список серверов через запятую, запросы распределяются между ними
+OLLAMA_BACKENDS = [url.strip().rstrip("/") for url in os.getenv("OLLAMA_BACKENDS", "http://localhost:11434").split(",")
+                   if url.strip()]
+OLLAMA_CHAT_PATH = "/api/chat"
+OLLAMA_GENERATE_PATH = "/api/generate"
+OLLAMA_HEALTH_PATH = "/api/tags"
+# Модель по умолчанию и модели для отдельных типов чатов ("seo=mistral,ads=llama3")
+OLLAMA_DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
+OLLAMA_CHAT_TYPE_MODELS = {
+    key.strip(): model.strip()
+    for key, model in (item.split("=", 1) for item in os.getenv("OLLAMA_CHAT_TYPE_MODELS", "").split(",")
+                       if "=" in item)
+    if key.strip() and model.strip()
+}
+# Проверка доступности серверов и размыкатель цепи
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "10"))
+# Сколько проверок подряд должен провалить сервер, чтобы его исключили из выбора
+OLLAMA_HEALTH_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_HEALTH_FAILURE_THRESHOLD", "3"))
+OLLAMA_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_CIRCUIT_FAILURE_THRESHOLD", "3"))
+OLLAMA_CIRCUIT_RESET_TIMEOUT = float(os.getenv("OLLAMA_CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Настройки базы данных (путь можно переопределить через переменную окружения CRM_DB_PATH)
+DATABASE_PATH = os.getenv("CRM_DB_PATH", "crm.db")
+DATABASE_POOL_SIZE = int(os.getenv("CRM_DB_POOL_SIZE", "8"))
+DATABASE_BUSY_TIMEOUT = 5.0  # секунды ожидания блокировки записи
+# Повторы пишущей транзакции, если блокировку записи дольше таймаута держит другой процесс
+DATABASE_WRITE_RETRIES = int(os.getenv("CRM_DB_WRITE_RETRIES", "3"))
+DATABASE_WRITE_RETRY_DELAY = 0.05  # начальная пауза между повторами, удваивается
+# Применять миграции схемы при старте приложения; многопроцессный запуск делает это один раз в главном процессе
+DATABASE_MIGRATE_ON_STARTUP = os.getenv("CRM_INIT_DB", "1") == "1"
+# FULL: каждая фиксация доходит до диска до ответа клиенту; цена fsync делится на пачку записей (write-behind)
+DATABASE_SYNCHRONOUS = os.getenv("CRM_DB_SYNCHRONOUS", "FULL")
+DATABASE_CACHED_STATEMENTS = 256  # размер кэша подготовленных выражений на соединение
+DATABASE_CACHE_SIZE_KB = 16384
+DATABASE_MMAP_SIZE = 128 * 1024 * 1024
+
+# Пул HTTP-соединений к Ollama
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))  # Увеличенный таймаут для локальных моделей
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "20"))
+OLLAMA_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "10"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "30"))
+# HTTP/2 включается, только если установлен пакет h2 (pip install httpx[http2])
+OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "0") == "1"
+# Сколько запросов к модели может выполняться одновременно
+OLLAMA_MAX_CONCURRENT_REQUESTS = int(os.getenv("OLLAMA_MAX_CONCURRENT_REQUESTS", "4"))
+# Сколько модель остается загруженной в память после запроса (формат Ollama: "30m", "1h", "-1" — всегда)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Сессии чатов: context из /api/generate сохраняется, и следующий ход отправляет только новое сообщение,
+# без повторной обработки системного промпта и истории
+OLLAMA_SESSIONS_ENABLED = os.getenv("OLLAMA_SESSIONS_ENABLED", "1") == "1"
+OLLAMA_SESSION_CACHE_BYTES = int(os.getenv("OLLAMA_SESSION_CACHE_MB", "64")) * 1024 * 1024
+# Сессии длиннее этого числа токенов не сохраняются: не больше num_ctx модели и с запасом больше CONTEXT_MAX_TOKENS,
+# иначе после полного промпта сессия не будет возобновляться
+OLLAMA_SESSION_MAX_TOKENS = int(os.getenv("OLLAMA_SESSION_MAX_TOKENS", "4096"))
+
+# Как часто (в секундах) проверять, не изменились ли файлы промптов на диске
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "5"))
+
+# Окно контекста: сколько токенов (оценочно) отправлять модели на каждый ход
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "500"))
+CONTEXT_SUMMARY_LINE_CHARS = 200  # сколько символов каждой старой реплики попадает в краткое содержание
+CONTEXT_CHARS_PER_TOKEN = 3.0  # грубая оценка для русского текста без токенизатора модели
+
+# Постраничная загрузка истории чата
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Поиск по истории чатов
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Экспорт и импорт чатов (NDJSON, по желанию gzip)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))  # строк на один запрос к БД
+EXPORT_CHUNK_SIZE = 64 * 1024  # байт в одном куске ответа
+EXPORT_GZIP_LEVEL = 6
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))  # сообщений на одну транзакцию
+
+# Кэш аутентификации: расшифрованные токены и данные пользователей
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+# Кэш метаданных чатов (id, название, тип, владелец)
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "10000"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "300"))
+
+# Хэширование паролей: стоимость bcrypt и пул потоков, в котором оно выполняется
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+# Ограничение попыток входа (на аккаунт и на IP) за окно в секундах
+LOGIN_MAX_ATTEMPTS_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", "5"))
+LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_MAX_ATTEMPTS_PER_IP", "20"))
+LOGIN_ATTEMPTS_WINDOW = float(os.getenv("LOGIN_ATTEMPTS_WINDOW", "60"))
+
+# Очередь заданий к модели
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(OLLAMA_MAX_CONCURRENT_REQUESTS)))
+INFERENCE_JOB_RESULT_TTL = float(os.getenv("INFERENCE_JOB_RESULT_TTL", "600"))  # сколько хранить результат
+INFERENCE_JOB_WAIT_TIMEOUT = float(os.getenv("INFERENCE_JOB_WAIT_TIMEOUT", "120"))  # ожидание в синхронном API
+INFERENCE_JOB_POLL_INTERVAL = 0.25  # опрос общего хранилища при ожидании задания другого воркера
+
+# Кэш ответов модели на повторяющиеся вопросы (по умолчанию выключен)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "0") == "1"
+# Типы чатов, для которых кэш включен (через запятую)
+RESPONSE_CACHE_CHAT_TYPES = frozenset(
+    t.strip() for t in os.getenv("RESPONSE_CACHE_CHAT_TYPES", "analysis,strategy,content,ads,seo,social").split(",")
+    if t.strip()
+)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+# Сохранять ли кэш в SQLite, чтобы он переживал перезапуск
+RESPONSE_CACHE_PERSISTENT = os.getenv("RESPONSE_CACHE_PERSISTENT", "0") == "1"
+# Сколько последних сообщений истории входит в ключ кэша
+RESPONSE_CACHE_CONTEXT_MESSAGES = int(os.getenv("RESPONSE_CACHE_CONTEXT_MESSAGES", "2"))
+
+# Пакетная запись сообщений: одна транзакция на пачку. Интервал 0 — писать сразу,
+# а пока идет запись, копить следующую пачку; > 0 — дополнительно ждать столько миллисекунд
+WRITE_BEHIND_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "0"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "256"))
+
+# Сжатие длинных сообщений в БД: none, zlib или zstd (нужен пакет zstandard, иначе zlib).
+# Читаются сжатые строки при любом значении, настройка влияет только на новые записи
+MESSAGE_COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "none")
+MESSAGE_COMPRESSION_MIN_BYTES = int(os.getenv("MESSAGE_COMPRESSION_MIN_BYTES", "1024"))
+MESSAGE_COMPRESSION_LEVEL = int(os.getenv("MESSAGE_COMPRESSION_LEVEL", "6"))
+
+# Сжатие HTTP-ответов (gzip, brotli — если установлен пакет brotli); потоковые ответы не сжимаются
+HTTP_COMPRESSION_MIN_SIZE = int(os.getenv("HTTP_COMPRESSION_MIN_SIZE", "1024"))
+HTTP_GZIP_LEVEL = 6
+HTTP_BROTLI_QUALITY = 4
+
+# Где хранить кэши аутентификации и чатов и лимиты входа: memory — в памяти процесса,
+# sqlite — общий файл, через который воркеры делят лимиты входа и рассылают друг другу сбросы кэша
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory")
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", os.path.splitext(DATABASE_PATH)[0] + "-state.db")
+SHARED_STATE_BUSY_TIMEOUT = 0.25
+# Как часто (секунд) воркер отправляет свои сбросы кэша и применяет чужие; столько же в худшем
+# случае другой воркер может отдавать устаревшую запись
+SHARED_STATE_SYNC_INTERVAL = float(os.getenv("SHARED_STATE_SYNC_INTERVAL", "0.2"))
+# Сколько секунд хранить журнал сбросов
+SHARED_STATE_INVALIDATION_RETENTION = 60
+
+# Многопроцессный запуск (python main.py --workers N); WEB_CONCURRENCY — как у gunicorn
+WEB_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+
+# Метрики: запросы дольше порога пишутся в лог с разбивкой по спанам (0 — не писать)
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "0"))
+# Доступ к /stats/* и /metrics: заголовок "Authorization: Bearer <токен>" (Prometheus передает его
+# через authorization в scrape_config). Пустой токен — эндпоинты выключены и отвечают 404
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
@@ -1,45 +1,158 @@
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+
+from app.config.core.global_var import DATABASE_PATH, DATABASE_POOL_SIZE, DATABASE_BUSY_TIMEOUT, \
+    DATABASE_CACHED_STATEMENTS, DATABASE_CACHE_SIZE_KB, DATABASE_MMAP_SIZE, DATABASE_SYNCHRONOUS
+from app.config.database.migrations import migrate
+from app.util.compression import decode_content
+
+
+class ConnectionPool:
+    """Ограниченный пул постоянных соединений с SQLite в режиме WAL"""
+
+    def __init__(self, path: str, size: int = DATABASE_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread=False: соединение может вернуться в пул из другого потока,
+        # но в каждый момент времени им пользуется только один владелец.
+        # cached_statements: подготовленные выражения переиспользуются, пока соединение живо
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DATABASE_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DATABASE_CACHED_STATEMENTS
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DATABASE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size=-{DATABASE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DATABASE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        # Распаковка сжатых сообщений прямо в SQL: snippet() в поиске и перестроение индекса (rebuild)
+        conn.create_function("crm_decompress", 1, decode_content, deterministic=True)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError("Пул соединений закрыт")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Пул исчерпан — ждем, пока кто-нибудь вернет соединение
+        return self._idle.get()
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_database_path = DATABASE_PATH
+
+
+def close_pool():
+    """Закрывает соединения пула; следующий запрос создаст новый пул"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def set_database_path(path: str):
+    """Меняет путь к файлу базы данных и пересоздает пул соединений"""
+    global _database_path
+    close_pool()
+    with _pool_lock:
+        _database_path = path
+
+
+def get_database_path() -> str:
+    return _database_path
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_database_path)
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """Берет соединение из пула на время блока with"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+@contextmanager
+def transaction():
+    """Соединение из пула с фиксацией изменений при выходе (или откатом при ошибке)"""
+    with get_pool().connection() as conn:
+        # BEGIN IMMEDIATE берет блокировку записи сразу: при нескольких процессах отложенная транзакция,
+        # начавшаяся с чтения, могла бы получить SQLITE_BUSY при попытке записи без ожидания busy_timeout
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            yield conn
 
 
 # Инициализация базы данных
 def init_db():
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            hashed_password TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Таблица чатов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            chat_type TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-
-    # Таблица сообщений
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (chat_id) REFERENCES chats (id)
-        )
-    ''')
+    """Приводит схему к последней версии; возвращает номера примененных миграций"""
+    with get_connection() as conn:
+        return migrate(conn)
+
 
-    conn.commit()
-    conn.close()
+def rebuild_search_index():
+    """Перестраивает полнотекстовый индекс по всем сообщениям (восстановление, если индекс разошелся с данными)"""
+    with transaction() as conn:
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import functools
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config.core.global_var import DATABASE_POOL_SIZE, DATABASE_WRITE_RETRIES, DATABASE_WRITE_RETRY_DELAY
+from app.util.metrics import span
+
+# Чтения выполняются параллельно в пуле потоков, все записи — в одном потоке-писателе.
+# Очередь писателя сериализует транзакции, поэтому запросы не борются за блокировку записи SQLite,
+# а event loop никогда не ждет диск.
+_read_executor = None
+_write_executor = None
+_lock = threading.Lock()
+
+
+def _get_read_executor() -> ThreadPoolExecutor:
+    global _read_executor
+    with _lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(
+                max_workers=max(1, DATABASE_POOL_SIZE - 1),
+                thread_name_prefix="db-read"
+            )
+        return _read_executor
+
+
+def _get_write_executor() -> ThreadPoolExecutor:
+    global _write_executor
+    with _lock:
+        if _write_executor is None:
+            _write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        return _write_executor
+
+
+async def run_read(func, *args, **kwargs):
+    """Выполняет читающую функцию в пуле потоков чтения"""
+    loop = asyncio.get_running_loop()
+    # Контекст копируется, чтобы спаны из потока попали в трассу текущего запроса
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_read_executor(), context.run, functools.partial(func, *args, **kwargs))
+
+
+async def run_write(func, *args, **kwargs):
+    """Ставит пишущую функцию в очередь потока-писателя"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_get_write_executor(), context.run, functools.partial(func, *args, **kwargs))
+
+
+def _timed(func):
+    # Спан "db.<имя функции>" меряет само выполнение в потоке, без ожидания в очереди пула
+    name = f"db.{func.__name__}"
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return timed
+
+
+def is_busy_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _retry_busy(func):
+    # Другой процесс может держать блокировку записи дольше busy_timeout (VACUUM, импорт);
+    # транзакция к этому моменту откачена, поэтому функцию репозитория можно просто повторить
+    @functools.wraps(func)
+    def retrying(*args, **kwargs):
+        delay = DATABASE_WRITE_RETRY_DELAY
+        for attempt in range(DATABASE_WRITE_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if attempt == DATABASE_WRITE_RETRIES or not is_busy_error(e):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    return retrying
+
+
+def db_read(func):
+    """Декоратор: превращает синхронную функцию репозитория в корутину, выполняемую вне event loop.
+    Синхронная версия остается доступной как func.sync (для скриптов и CLI)"""
+    timed = _timed(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_read(timed, *args, **kwargs)
+
+    wrapper.sync = func
+    return wrapper
+
+
+def db_write(func):
+    """То же, что db_read, но через очередь записи; при занятой другим процессом базе запись повторяется"""
+    timed = _timed(_retry_busy(func))
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_write(timed, *args, **kwargs)
+
+    wrapper.sync = func
+    return wrapper
+
+
+def shutdown_executors():
+    """Дожидается завершения поставленных в очередь операций и останавливает потоки"""
+    global _read_executor, _write_executor
+    with _lock:
+        executors = [e for e in (_read_executor, _write_executor) if e is not None]
+        _read_executor = None
+        _write_executor = None
+    for executor in executors:
+        executor.shutdown(wait=True)
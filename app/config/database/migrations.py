@@ -0,0 +1,227 @@
+import logging
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger("crm.migrations")
+
+
+def _table_exists(cursor: sqlite3.Cursor, name: str) -> bool:
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _rebuild_fts(cursor: sqlite3.Cursor):
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('optimize')")
+
+
+def _baseline(cursor: sqlite3.Cursor):
+    """Схема на момент появления миграций; все выражения идемпотентны, поэтому безопасны и для старых баз"""
+    # Таблица пользователей
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            hashed_password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица чатов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            chat_type TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # Таблица сообщений
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats (id)
+        )
+    ''')
+
+    # Краткое содержание старой части диалога, которая уже не помещается в окно контекста
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            chat_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (chat_id) REFERENCES chats (id)
+        )
+    ''')
+
+    # Постоянный уровень кэша ответов модели
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+
+    # Полнотекстовый поиск по сообщениям. Индекс хранит только токены, текст берется из представления
+    # messages_search; колонка owner ("u<id пользователя>") позволяет FTS сразу ограничить поиск
+    # сообщениями одного пользователя, не перебирая совпадения из чужих чатов.
+    # Префиксный индекс ускоряет короткие запросы вида "ма*", которые дает поиск по началу слова
+    fts_existed = _table_exists(cursor, "messages_fts")
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, owner,
+            content='messages_search', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    # Длинные сообщения могут храниться сжатыми, поэтому представление и триггеры читают текст
+    # через crm_decompress (регистрируется на каждом соединении пула). Пересоздаются, чтобы базы,
+    # созданные до появления сжатия, тоже получили новые определения
+    for name in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute("DROP VIEW IF EXISTS messages_search")
+    cursor.execute('''
+        CREATE VIEW messages_search AS
+        SELECT m.id AS id, crm_decompress(m.content) AS content, 'u' || c.user_id AS owner
+        FROM messages m JOIN chats c ON c.id = m.chat_id
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content, owner)
+            VALUES (new.id, crm_decompress(new.content), (SELECT 'u' || user_id FROM chats WHERE id = new.chat_id));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            VALUES ('delete', old.id, crm_decompress(old.content),
+                    (SELECT 'u' || user_id FROM chats WHERE id = old.chat_id));
+        END
+    ''')
+    # Сжатие и распаковка не меняют текст — индекс трогаем, только если он действительно изменился
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages
+        WHEN crm_decompress(old.content) IS NOT crm_decompress(new.content) BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            VALUES ('delete', old.id, crm_decompress(old.content),
+                    (SELECT 'u' || user_id FROM chats WHERE id = old.chat_id));
+            INSERT INTO messages_fts (rowid, content, owner)
+            VALUES (new.id, crm_decompress(new.content), (SELECT 'u' || user_id FROM chats WHERE id = new.chat_id));
+        END
+    ''')
+    if not fts_existed:
+        # Индекс внешнего содержимого создается пустым; триггер удаления для сообщения, которого нет
+        # в индексе, портит его ("database disk image is malformed"), поэтому заполняем сразу
+        _rebuild_fts(cursor)
+
+    # Индексы под основные запросы: сообщения чата по порядку, чаты пользователя по дате создания
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages (chat_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_created ON chats (user_id, created_at DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache (created_at)")
+
+
+def _repair_fts(cursor: sqlite3.Cursor):
+    """Базы, прошедшие baseline до исправления, могли получить пустой индекс при непустых сообщениях"""
+    indexed = cursor.execute("SELECT COUNT(*) FROM messages_fts_docsize").fetchone()[0]
+    stored = cursor.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    if indexed != stored:
+        _rebuild_fts(cursor)
+
+
+def _fts_triggers_without_udf(cursor: sqlite3.Cursor):
+    """
+    Триггеры индекса без crm_decompress: любое соединение SQLite (консоль, IDE, скрипты) может писать в messages
+
+    Триггеры индексируют только несжатые строки (TEXT) — их текст доступен обычному SQL. Сжатые строки
+    (BLOB) добавляет в индекс и убирает из него код репозитория, у которого есть исходный текст
+    (см. chat_repositories). Представление messages_search по-прежнему читает через crm_decompress:
+    им пользуются только snippet() и перестроение индекса, а они выполняются из приложения.
+    """
+    for name in ("messages_fts_insert", "messages_fts_delete", "messages_fts_update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages
+        WHEN typeof(new.content) = 'text' BEGIN
+            INSERT INTO messages_fts (rowid, content, owner)
+            VALUES (new.id, new.content, (SELECT 'u' || user_id FROM chats WHERE id = new.chat_id));
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages
+        WHEN typeof(old.content) = 'text' BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            VALUES ('delete', old.id, old.content, (SELECT 'u' || user_id FROM chats WHERE id = old.chat_id));
+        END
+    ''')
+    # Один триггер, а не два: порядок срабатывания нескольких триггеров SQLite не гарантирует, а удаление
+    # старого текста из индекса должно идти до вставки нового. Сжатие строки (TEXT -> BLOB) убирает ее
+    # из индекса здесь, а репозиторий добавляет обратно с исходным текстом
+    cursor.execute('''
+        CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages
+        WHEN old.content IS NOT new.content BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            SELECT 'delete', old.id, old.content, (SELECT 'u' || user_id FROM chats WHERE id = old.chat_id)
+            WHERE typeof(old.content) = 'text';
+            INSERT INTO messages_fts (rowid, content, owner)
+            SELECT new.id, new.content, (SELECT 'u' || user_id FROM chats WHERE id = new.chat_id)
+            WHERE typeof(new.content) = 'text';
+        END
+    ''')
+
+
+# Версии схемы по порядку; номер последней хранится в PRAGMA user_version.
+# Новую миграцию добавляют в конец списка, уже выпущенные не меняют
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "baseline", _baseline),
+    (2, "repair_fts", _repair_fts),
+    (3, "fts_triggers_without_udf", _fts_triggers_without_udf),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> List[int]:
+    """
+    Применяет недостающие миграции и возвращает их номера
+
+    Если схема актуальна, дело ограничивается одним чтением PRAGMA user_version — без транзакции
+    и без DDL. Иначе версия перепроверяется под блокировкой записи: воркеры, стартующие
+    одновременно, не применят одну миграцию дважды.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(conn)
+        cursor = conn.cursor()
+        for version, name, func in MIGRATIONS:
+            if version <= current:
+                continue
+            started = time.perf_counter()
+            func(cursor)
+            applied.append(version)
+            logger.info("Миграция %s (%s) применена за %.1f мс", version, name,
+                        (time.perf_counter() - started) * 1000)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return applied
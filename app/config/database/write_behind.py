@@ -0,0 +1,76 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from app.config.core.global_var import WRITE_BEHIND_FLUSH_INTERVAL_MS, WRITE_BEHIND_MAX_BATCH
+
+
+class WriteBehindBuffer:
+    """
+    Буфер записи с групповой фиксацией
+
+    Строки от всех запросов копятся в памяти и записываются одной транзакцией (не больше
+    max_batch строк). Пока идет запись одной пачки, следующая набирается, поэтому под
+    нагрузкой пачки растут сами, а в простое строка пишется без задержки; flush_interval_ms > 0
+    дополнительно придерживает первую строку, чтобы собрать пачку. Вызывающий получает id
+    строки только после фиксации транзакции: подтверждение клиенту означает, что данные на
+    диске, но fsync приходится один на пачку.
+    """
+
+    def __init__(self, flush_func: Callable[[Sequence[tuple]], Awaitable[List[int]]],
+                 flush_interval_ms: float = WRITE_BEHIND_FLUSH_INTERVAL_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH):
+        self.flush_func = flush_func
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self._buffer: List[Tuple[tuple, asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.rows = 0
+
+    async def add(self, row: tuple) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((row, future))
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        try:
+            if self.flush_interval:
+                await asyncio.sleep(self.flush_interval)
+            while self._buffer:
+                await self._flush_batch()
+        finally:
+            self._task = None
+
+    async def _flush_batch(self):
+        # Забираем пачку синхронно: строки, пришедшие во время записи, попадут в следующую
+        batch, self._buffer = self._buffer[:self.max_batch], self._buffer[self.max_batch:]
+        try:
+            ids = await self.flush_func([row for row, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for (_, future), row_id in zip(batch, ids):
+            if not future.done():
+                future.set_result(row_id)
+
+    async def flush(self):
+        """Дожидается записи всего накопленного (при остановке приложения)"""
+        if self._task is not None:
+            await self._task
+        while self._buffer:
+            await self._flush_batch()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": round(self.rows / self.batches, 2) if self.batches else 0.0,
+            "flush_interval_ms": self.flush_interval * 1000,
+            "max_batch": self.max_batch,
+        }
@@ -3,14 +3,23 @@ from datetime import timedelta
 from fastapi import HTTPException, APIRouter, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette import status
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import RedirectResponse, HTMLResponse
 
 from app.config.core.config import templates
 from app.repositories.authenticate_repository import authenticate_user, create_access_token
-from app.config.core.global_var import ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config.core.global_var import ACCESS_TOKEN_EXPIRE_MINUTES, LOGIN_MAX_ATTEMPTS_PER_ACCOUNT, \
+    LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_ATTEMPTS_WINDOW
+from app.util.passwords import PasswordHashingBusy
+from app.util.shared_state import make_rate_limiter
 
 router = APIRouter(prefix="/login", tags=["login"])
 
+# Ограничиваем попытки входа до проверки пароля, чтобы перебор не загружал пул bcrypt
+# (при нескольких воркерах и SHARED_STATE_BACKEND=sqlite лимит общий для всех процессов)
+account_limiter = make_rate_limiter("login_account", LOGIN_MAX_ATTEMPTS_PER_ACCOUNT, LOGIN_ATTEMPTS_WINDOW)
+ip_limiter = make_rate_limiter("login_ip", LOGIN_MAX_ATTEMPTS_PER_IP, LOGIN_ATTEMPTS_WINDOW)
+
 
 # Маршруты для аутентификации
 @router.get("/", response_class=HTMLResponse)
@@ -20,13 +29,32 @@ async def login_page(request: Request):
 
 @router.post("/", response_model=None)
 async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    account_key = form_data.username.lower()
+    ip_key = request.client.host if request.client else "unknown"
+    # Общий лимитер ждет блокировку файла SQLite, поэтому вызывается вне event loop
+    for limiter, key in ((ip_limiter, ip_key), (account_limiter, account_key)):
+        if not await run_in_threadpool(limiter.hit, key):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Слишком много попыток входа. Попробуйте позже",
+                headers={"Retry-After": str(await run_in_threadpool(limiter.retry_after, key))},
+            )
+
+    try:
+        user = await authenticate_user(form_data.username, form_data.password)
+    except PasswordHashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен. Попробуйте позже",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверное имя пользователя или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await run_in_threadpool(account_limiter.reset, account_key)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["username"]}, expires_delta=access_token_expires
@@ -1,11 +1,17 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from starlette.responses import RedirectResponse
 
+from app.repositories.user_repositories import invalidate_token
+
 router = APIRouter(prefix="/logout", tags=["logout"])
 
 
 @router.get("/")
-async def logout():
+async def logout(request: Request):
+    token = request.cookies.get("access_token")
+    if token:
+        invalidate_token(token)
+
     response = RedirectResponse(url="/login", status_code=303)
     response.delete_cookie("access_token")
     return response
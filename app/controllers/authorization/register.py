@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, HTTPException
 from fastapi.params import Form
+from starlette import status
 from starlette.responses import RedirectResponse, HTMLResponse
 
 from app.config.core.config import templates
 from app.repositories.user_repositories import get_user_by_username, create_user
+from app.util.passwords import PasswordHashingBusy
 
 router = APIRouter(prefix="/register", tags=["register"])
 
@@ -15,7 +17,7 @@ async def register_page(request: Request):
 
 @router.post("/", response_model=None)
 async def register(request: Request, username: str = Form(...), email: str = Form(...), password: str = Form(...)):
-    existing_user = get_user_by_username(username)
+    existing_user = await get_user_by_username(username)
     if existing_user:
         return templates.TemplateResponse("register.html", {
             "request": request,
@@ -23,7 +25,14 @@ async def register(request: Request, username: str = Form(...), email: str = For
             "error": "Пользователь с таким именем уже существует"
         })
 
-    user = create_user(username, email, password)
+    try:
+        user = await create_user(username, email, password)
+    except PasswordHashingBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Сервер перегружен. Попробуйте позже",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         return templates.TemplateResponse("register.html", {
             "request": request,
@@ -1,12 +1,22 @@
-from fastapi import Request, Form, Depends, HTTPException, APIRouter
-from fastapi.responses import HTMLResponse, RedirectResponse
-import sqlite3
-
-from app.config.core.config import templates
-from app.config.core.depends import bot
-from app.repositories.chat_repositories import get_user_chats, create_chat, add_message, get_chat_messages, \
-    clear_chat_history
+import asyncio
+import json
+import zlib
+from typing import Optional
+
+from fastapi import Request, Form, Depends, HTTPException, APIRouter, Query, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, JSONResponse
+
+from app.ai_agent.job_queue import FAILED
+from app.config.core.config import templates, static_files
+from app.config.core.depends import job_queue
+from app.config.core.global_var import HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, INFERENCE_JOB_WAIT_TIMEOUT, \
+    SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE
+from app.repositories.chat_repositories import add_message, get_chat_messages_page
+from app.repositories.search_repositories import search_messages
 from app.repositories.user_repositories import get_current_user
+from app.services.chat_service import get_user_chat, create_user_chat, clear_user_chat, get_user_chat_list
+from app.services.export_service import export_chunks, import_records, open_export, ImportFormatError
+from app.util.http_cache import make_etag, latest_timestamp, is_not_modified, not_modified, cache_headers
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
@@ -22,15 +32,20 @@ async def dashboard(request: Request, current_user: dict = Depends(get_current_u
     if not current_user:
         return RedirectResponse(url="/login")
 
-    # Получаем список чатов пользователя
-    chats = get_user_chats(current_user["id"])
+    # Получаем список чатов пользователя (из кэша; сбрасывается при создании чата)
+    chat_list = await get_user_chat_list(current_user["id"])
+
+    # Страница зависит от списка чатов, пользователя и версии статики; если ничего не менялось — 304 без рендера
+    etag = make_etag(chat_list["etag"], current_user["id"], current_user["username"], static_files.version)
+    if is_not_modified(request, etag, chat_list["last_modified"]):
+        return not_modified(etag, chat_list["last_modified"])
 
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "title": "Панель управления",
         "user": current_user,
-        "chats": chats
-    })
+        "chats": chat_list["chats"]
+    }, headers=cache_headers(etag, chat_list["last_modified"]))
 
 
 @router.get("/chat/{chat_id}", response_class=HTMLResponse)
@@ -38,17 +53,17 @@ async def chat_page(request: Request, chat_id: int, current_user: dict = Depends
     if not current_user:
         return RedirectResponse(url="/login")
 
-    chat = chat_belong_user(chat_id, current_user)
+    chat = await chat_belong_user(chat_id, current_user)
 
     if not chat:
         return RedirectResponse(url="/dashboard")
 
     return templates.TemplateResponse("chat.html", {
         "request": request,
-        "title": chat[1],
-        "chat_id": chat[0],
-        "chat_name": chat[1],
-        "chat_type": chat[2],
+        "title": chat["name"],
+        "chat_id": chat["id"],
+        "chat_name": chat["name"],
+        "chat_type": chat["chat_type"],
         "user": current_user
     })
 
@@ -63,7 +78,7 @@ async def create_chat_endpoint(
     if not current_user:
         raise HTTPException(status_code=401, detail="Не авторизован")
 
-    chat_id = create_chat(current_user["id"], name, chat_type)
+    chat_id = await create_user_chat(current_user["id"], name, chat_type)
 
     # Добавляем приветственное сообщение от бота
     welcome_messages = {
@@ -76,7 +91,7 @@ async def create_chat_endpoint(
     }
 
     welcome_message = welcome_messages.get(chat_type, "Привет! Я ваш маркетинговый ИИ-ассистент. Чем могу помочь?")
-    add_message(chat_id, "assistant", welcome_message)
+    await add_message(chat_id, "assistant", welcome_message)
 
     return {"chat_id": chat_id}
 
@@ -90,39 +105,186 @@ async def chat_message(
     if not current_user:
         raise HTTPException(status_code=401, detail="Не авторизован")
 
-    chat = chat_belong_user(chat_id, current_user)
+    chat = await chat_belong_user(chat_id, current_user)
 
     if not chat:
         raise HTTPException(status_code=404, detail="Чат не найден")
 
-    # Добавляем сообщение пользователя
-    add_message(chat_id, "user", message)
-
-    # Получаем историю чата
-    history = get_chat_messages(chat_id)
+    # Ход диалога выполняется через общую очередь заданий; здесь просто дожидаемся результата
+    job = await job_queue.submit(current_user["id"], chat, message)
+    try:
+        await job_queue.wait(job, timeout=INFERENCE_JOB_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Модель не ответила вовремя", headers={"X-Job-Id": job.id})
 
-    # Получаем ответ от ИИ агента
-    bot_response = await bot.get_response(message, history, chat[0])
-
-    # Добавляем ответ бота
-    add_message(chat_id, "assistant", bot_response)
+    if job.status == FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
 
     return {
         "user_message": message,
-        "bot_response": bot_response
+        "bot_response": job.result
     }
 
 
+@router.post("/chat/{chat_id}/jobs")
+async def submit_chat_job(
+        chat_id: int,
+        message: str = Form(...),
+        current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    chat = await chat_belong_user(chat_id, current_user)
+
+    if not chat:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
+    # Возвращаем id задания сразу; результат клиент получает через /chat/jobs/{job_id}
+    job = await job_queue.submit(current_user["id"], chat, message)
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}")
+async def get_chat_job(job_id: str, wait: float = Query(0, ge=0, le=60),
+                       current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    job = job_queue.get(job_id)
+    if job is None:
+        # Задание принял другой воркер — берем его состояние из общего хранилища
+        record = await job_queue.lookup(job_id, wait=wait)
+        if not record or record.pop("user_id") != current_user["id"]:
+            raise HTTPException(status_code=404, detail="Задание не найдено")
+        return record
+
+    if job.user_id != current_user["id"]:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+
+    # wait > 0 — long polling: ждем завершения задания не дольше wait секунд
+    if wait:
+        try:
+            await job_queue.wait(job, timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+    return job.to_dict()
+
+
+@router.post("/chat/{chat_id}/message/stream")
+async def chat_message_stream(
+        chat_id: int,
+        message: str = Form(...),
+        current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    chat = await chat_belong_user(chat_id, current_user)
+
+    if not chat:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
+    # Ход выполняется в общей очереди (честное планирование и объединение дублей), здесь только подписка
+    # на его токены; генерация и сохранение ответа не зависят от того, дочитает ли клиент поток
+    job = await job_queue.submit(current_user["id"], chat, message, stream=True)
+
+    async def events():
+        # Пересылаем токены в браузер по мере генерации (Server-Sent Events)
+        async for token in job.tokens_stream():
+            yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+
+        if job.status == FAILED:
+            yield f"event: error\ndata: {json.dumps({'detail': job.error}, ensure_ascii=False)}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'message_id': job.message_id})}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/chat/{chat_id}/history")
-async def get_chat_history(chat_id: int, current_user: dict = Depends(get_current_user)):
+async def get_chat_history(
+        request: Request,
+        chat_id: int,
+        before_id: Optional[int] = Query(None, ge=1),
+        limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+        current_user: dict = Depends(get_current_user)
+):
     if not current_user:
         raise HTTPException(status_code=401, detail="Не авторизован")
 
-    if not chat_belong_user(chat_id, current_user):
+    if not await chat_belong_user(chat_id, current_user):
         raise HTTPException(status_code=404, detail="Чат не найден")
 
-    messages = get_chat_messages(chat_id)
-    return {"history": messages}
+    # Страница сообщений перед before_id; следующую (более старую) страницу клиент запрашивает с next_before_id
+    messages, has_more = await get_chat_messages_page(chat_id, before_id, limit)
+    payload = {
+        "history": messages,
+        "has_more": has_more,
+        "next_before_id": messages[0]["id"] if has_more else None
+    }
+
+    # ETag по содержимому страницы: на ту же страницу влияют и новые сообщения, и очистка чата
+    etag = make_etag(json.dumps(payload, ensure_ascii=False, sort_keys=True))
+    last_modified = latest_timestamp(msg["timestamp"] for msg in messages)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    return JSONResponse(payload, headers=cache_headers(etag, last_modified))
+
+
+@router.get("/search")
+async def search_chats(
+        q: str = Query(..., min_length=1, max_length=200),
+        page: int = Query(1, ge=1),
+        per_page: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+        current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    # Поиск по всем чатам пользователя; фрагменты уже экранированы, совпадения обернуты в <mark>
+    hits, has_more = await search_messages(current_user["id"], q, per_page, (page - 1) * per_page)
+    return {
+        "query": q,
+        "page": page,
+        "results": hits,
+        "has_more": has_more
+    }
+
+
+@router.get("/export")
+async def export_chats(
+        export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|gzip)$"),
+        current_user: dict = Depends(get_current_user)
+):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    # Все чаты пользователя потоком NDJSON: память не растет с объемом истории
+    compress = export_format == "gzip"
+    filename = f"chats-{current_user['id']}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        export_chunks(current_user["id"], compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"}
+    )
+
+
+@router.post("/import")
+async def import_chats(file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Не авторизован")
+
+    # Загруженный файл уже лежит во временном файле на диске; читаем его построчно
+    try:
+        imported = await import_records(current_user["id"], open_export(file.file))
+    except (ImportFormatError, OSError, EOFError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return imported
 
 
 @router.post("/chat/{chat_id}/clear")
@@ -130,18 +292,13 @@ async def clear_chat(chat_id: int, current_user: dict = Depends(get_current_user
     if not current_user:
         raise HTTPException(status_code=401, detail="Не авторизован")
 
-    if not chat_belong_user(chat_id, current_user):
+    if not await chat_belong_user(chat_id, current_user):
         raise HTTPException(status_code=404, detail="Чат не найден")
 
-    clear_chat_history(chat_id)
+    await clear_user_chat(chat_id, current_user["id"])
     return {"message": "История очищена"}
 
 
-# Проверяем, что чат принадлежит пользователю
-def chat_belong_user(chat_id: int, current_user: dict = Depends(get_current_user)):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM chats WHERE id = ? AND user_id = ?", (chat_id, current_user["id"]))
-    chat = cursor.fetchone()
-    conn.close()
-    return chat
+# Проверяем, что чат принадлежит пользователю (возвращает метаданные чата или None)
+async def chat_belong_user(chat_id: int, current_user: dict = Depends(get_current_user)):
+    return await get_user_chat(chat_id, current_user["id"])
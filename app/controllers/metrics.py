@@ -0,0 +1,24 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+
+from app.config.core.depends import bot, job_queue, require_stats_access
+from app.repositories.chat_repositories import message_writer
+from app.util.metrics import registry, GaugeCallback
+
+router = APIRouter(tags=["monitoring"])
+
+# Текущее состояние очередей считывается в момент запроса метрик
+registry.register(GaugeCallback("crm_model_in_flight", "Запросов к модели в работе",
+                                lambda: bot.pool_stats()["in_flight"]))
+registry.register(GaugeCallback("crm_model_waiting", "Запросов, ожидающих слота модели",
+                                lambda: bot.pool_stats()["waiting"]))
+registry.register(GaugeCallback("crm_job_queue_depth", "Заданий в очереди модели",
+                                lambda: job_queue.metrics()["queue_depth"]))
+registry.register(GaugeCallback("crm_write_behind_pending", "Сообщений в буфере записи",
+                                lambda: message_writer.stats()["buffered"]))
+
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_stats_access)])
+async def metrics():
+    # Формат текстовой выдачи Prometheus
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
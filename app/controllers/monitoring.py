@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, Request
+
+from app.config.core.depends import bot, job_queue, require_stats_access
+from app.repositories.chat_repositories import message_writer
+from app.repositories.user_repositories import auth_cache_stats
+from app.services.chat_service import chat_cache_stats
+from app.util.passwords import password_pool_stats
+
+router = APIRouter(prefix="/stats", tags=["monitoring"], dependencies=[Depends(require_stats_access)])
+
+
+@router.get("/ollama")
+async def ollama_stats():
+    return bot.pool_stats()
+
+
+@router.get("/auth")
+async def auth_stats():
+    return auth_cache_stats()
+
+
+@router.get("/chats")
+async def chats_stats():
+    return chat_cache_stats()
+
+
+@router.get("/passwords")
+async def passwords_stats():
+    return password_pool_stats()
+
+
+@router.get("/jobs")
+async def jobs_stats():
+    return job_queue.metrics()
+
+
+@router.get("/response_cache")
+async def response_cache_stats():
+    return bot.response_cache.stats()
+
+
+@router.get("/writer")
+async def writer_stats():
+    return message_writer.stats()
+
+
+@router.get("/sessions")
+async def sessions_stats():
+    # Сессии чатов в модели (повторное использование context); None, если выключены
+    return bot.sessions.stats() if bot.sessions is not None else None
+
+
+@router.get("/startup")
+async def startup_stats(request: Request):
+    # Длительность этапов запуска (мс) и миграции, примененные при старте
+    return {
+        "timings_ms": request.app.state.startup_timings,
+        "applied_migrations": request.app.state.applied_migrations,
+    }
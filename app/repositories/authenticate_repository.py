@@ -1,28 +1,23 @@
 from datetime import datetime, timedelta
 from typing import Optional
 
-from jose import jwt
-
-from app.config.core.config import pwd_context
 from app.repositories.user_repositories import get_user_by_username
 from app.config.core.global_var import SECRET_KEY, ALGORITHM
+from app.util.passwords import verify_password
 
 
-# Функции безопасности
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def authenticate_user(username: str, password: str):
-    user = get_user_by_username(username)
+async def authenticate_user(username: str, password: str):
+    user = await get_user_by_username(username)
     if not user:
         return False
-    if not verify_password(password, user["hashed_password"]):
+    if not await verify_password(password, user["hashed_password"]):
         return False
     return user
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
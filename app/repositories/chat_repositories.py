@@ -1,59 +1,206 @@
-import sqlite3
+from typing import Iterable, Optional, Sequence
 
+from app.config.database.db_config import get_connection, transaction
+from app.config.database.db_executor import db_read, db_write
+from app.config.database.write_behind import WriteBehindBuffer
+from app.util.compression import MessageCodec, encode_content, decode_content
 
+
+@db_write
 def create_chat(user_id: int, name: str, chat_type: str):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO chats (user_id, name, chat_type) VALUES (?, ?, ?)",
-        (user_id, name, chat_type)
-    )
-    conn.commit()
-    chat_id = cursor.lastrowid
-    conn.close()
-    return chat_id
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO chats (user_id, name, chat_type) VALUES (?, ?, ?)",
+            (user_id, name, chat_type)
+        )
+        return cursor.lastrowid
+
+
+@db_read
+def get_user_chats_after(user_id: int, after_id: int, limit: int):
+    # Keyset-обход всех чатов пользователя по возрастанию id (для экспорта)
+    with get_connection() as conn:
+        chats = conn.execute(
+            "SELECT id, name, chat_type, created_at FROM chats WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (user_id, after_id, limit)
+        ).fetchall()
+    return [{"id": chat[0], "name": chat[1], "chat_type": chat[2], "created_at": chat[3]} for chat in chats]
 
 
+@db_read
 def get_user_chats(user_id: int):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, name, chat_type, created_at FROM chats WHERE user_id = ? ORDER BY created_at DESC",
-        (user_id,)
-    )
-    chats = cursor.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        chats = conn.execute(
+            "SELECT id, name, chat_type, created_at FROM chats WHERE user_id = ? ORDER BY created_at DESC",
+            (user_id,)
+        ).fetchall()
     return [{"id": chat[0], "name": chat[1], "chat_type": chat[2], "created_at": chat[3]} for chat in chats]
 
 
-def add_message(chat_id: int, role: str, content: str):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
-        (chat_id, role, content)
-    )
-    conn.commit()
-    message_id = cursor.lastrowid
-    conn.close()
+# Триггеры индексируют только несжатые строки (схема не зависит от crm_decompress),
+# сжатые добавляются в индекс и убираются из него здесь — по исходному тексту
+_FTS_INDEX = (
+    "INSERT INTO messages_fts (rowid, content, owner) "
+    "VALUES (?, ?, (SELECT 'u' || user_id FROM chats WHERE id = ?))"
+)
+_FTS_UNINDEX = (
+    "INSERT INTO messages_fts (messages_fts, rowid, content, owner) "
+    "VALUES ('delete', ?, ?, (SELECT 'u' || user_id FROM chats WHERE id = ?))"
+)
+
+
+def _insert_message(conn, chat_id: int, role: str, content: str, timestamp: Optional[str] = None) -> int:
+    stored = encode_content(content)
+    message_id = conn.execute(
+        "INSERT INTO messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+        (chat_id, role, stored, timestamp)
+    ).lastrowid
+    if isinstance(stored, bytes):
+        conn.execute(_FTS_INDEX, (message_id, content, chat_id))
     return message_id
 
 
-def get_chat_messages(chat_id: int):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT role, content, timestamp FROM messages WHERE chat_id = ? ORDER BY timestamp ASC",
-        (chat_id,)
-    )
-    messages = cursor.fetchall()
-    conn.close()
-    return [{"role": msg[0], "content": msg[1], "timestamp": msg[2]} for msg in messages]
+@db_write
+def add_messages_bulk(rows: Sequence[tuple]):
+    # rows: (chat_id, role, content) — все строки пишутся одной транзакцией
+    with transaction() as conn:
+        return [_insert_message(conn, chat_id, role, content) for chat_id, role, content in rows]
+
+
+# Сообщения от всех запросов записываются пачками (групповая фиксация)
+message_writer = WriteBehindBuffer(add_messages_bulk)
+
+
+async def add_message(chat_id: int, role: str, content: str):
+    # Возвращает id после фиксации транзакции, в которую попало сообщение
+    return await message_writer.add((chat_id, role, content))
+
+
+@db_write
+def import_chat(user_id: int, name: str, chat_type: str, messages: Iterable[dict], created_at: Optional[str] = None):
+    """Импорт готового диалога одной транзакцией; messages — словари role, content и необязательный timestamp"""
+    with transaction() as conn:
+        chat_id = conn.execute(
+            "INSERT INTO chats (user_id, name, chat_type, created_at) VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+            (user_id, name, chat_type, created_at)
+        ).lastrowid
+        for msg in messages:
+            _insert_message(conn, chat_id, msg["role"], msg["content"], msg.get("timestamp"))
+        return chat_id
+
+
+@db_write
+def import_messages(rows: Sequence[tuple]):
+    # rows: (chat_id, role, content, timestamp) — пачка импортируемых сообщений одной транзакцией
+    with transaction() as conn:
+        for chat_id, role, content, timestamp in rows:
+            _insert_message(conn, chat_id, role, content, timestamp)
 
 
+@db_read
+def get_chat_messages_page(chat_id: int, before_id: Optional[int] = None, limit: int = 50):
+    # Keyset-пагинация: страница из limit сообщений перед before_id (или самых последних), по возрастанию id.
+    # Берем на одну строку больше, чтобы узнать, есть ли еще более старые сообщения
+    with get_connection() as conn:
+        if before_id is None:
+            messages = conn.execute(
+                "SELECT id, role, content, timestamp FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+                (chat_id, limit + 1)
+            ).fetchall()
+        else:
+            messages = conn.execute(
+                "SELECT id, role, content, timestamp FROM messages WHERE chat_id = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (chat_id, before_id, limit + 1)
+            ).fetchall()
+    has_more = len(messages) > limit
+    page = [{"id": msg[0], "role": msg[1], "content": decode_content(msg[2]), "timestamp": msg[3]}
+            for msg in reversed(messages[:limit])]
+    return page, has_more
+
+
+@db_read
+def get_chat_messages_after(chat_id: int, after_id: int, limit: Optional[int] = None):
+    # limit=None — все сообщения после after_id (LIMIT -1 в SQLite означает "без ограничения")
+    with get_connection() as conn:
+        messages = conn.execute(
+            "SELECT id, role, content, timestamp FROM messages WHERE chat_id = ? AND id > ? ORDER BY id ASC LIMIT ?",
+            (chat_id, after_id, -1 if limit is None else limit)
+        ).fetchall()
+    return [{"id": msg[0], "role": msg[1], "content": decode_content(msg[2]), "timestamp": msg[3]} for msg in messages]
+
+
+@db_write
+def recode_messages(after_id: int, limit: int, codec: MessageCodec):
+    """
+    Пересохраняет пачку сообщений с id > after_id в формате codec (сжатие или распаковка старых строк)
+
+    Returns:
+        (id последнего просмотренного сообщения или None, если сообщений больше нет; число измененных строк)
+    """
+    with transaction() as conn:
+        rows = conn.execute(
+            "SELECT id, chat_id, content FROM messages WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        ).fetchall()
+        if not rows:
+            return None, 0
+        updated = 0
+        for message_id, chat_id, stored in rows:
+            text = decode_content(stored)
+            recoded = codec.encode(text)
+            if recoded == stored:
+                continue
+            # Несжатую сторону индекса обслуживают триггеры; смена алгоритма (BLOB -> BLOB) текст не меняет
+            if isinstance(stored, bytes) and not isinstance(recoded, bytes):
+                conn.execute(_FTS_UNINDEX, (message_id, text, chat_id))
+            conn.execute("UPDATE messages SET content = ? WHERE id = ?", (recoded, message_id))
+            if isinstance(recoded, bytes) and not isinstance(stored, bytes):
+                conn.execute(_FTS_INDEX, (message_id, text, chat_id))
+            updated += 1
+        return rows[-1][0], updated
+
+
+@db_write
 def clear_chat_history(chat_id: int):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        compressed = conn.execute(
+            "SELECT id, content FROM messages WHERE chat_id = ? AND typeof(content) = 'blob'", (chat_id,)
+        ).fetchall()
+        conn.executemany(_FTS_UNINDEX, ((message_id, decode_content(stored), chat_id) for message_id, stored in compressed))
+        conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM chat_summaries WHERE chat_id = ?", (chat_id,))
+
+
+@db_read
+def get_chat_summary(chat_id: int):
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT summary, last_message_id FROM chat_summaries WHERE chat_id = ?",
+            (chat_id,)
+        ).fetchone()
+    if row:
+        return {"summary": row[0], "last_message_id": row[1]}
+    return None
+
+
+@db_write
+def save_chat_summary(chat_id: int, summary: str, last_message_id: int):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO chat_summaries (chat_id, summary, last_message_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET summary = excluded.summary, "
+            "last_message_id = excluded.last_message_id, updated_at = CURRENT_TIMESTAMP",
+            (chat_id, summary, last_message_id)
+        )
+
+
+@db_read
+def get_chat_for_user(chat_id: int, user_id: int):
+    with get_connection() as conn:
+        chat = conn.execute(
+            "SELECT id, user_id, name, chat_type FROM chats WHERE id = ? AND user_id = ?",
+            (chat_id, user_id)
+        ).fetchone()
+    if chat:
+        return {"id": chat[0], "user_id": chat[1], "name": chat[2], "chat_type": chat[3]}
+    return None
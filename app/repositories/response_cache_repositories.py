@@ -0,0 +1,27 @@
+from app.config.database.db_config import get_connection, transaction
+from app.config.database.db_executor import db_read, db_write
+
+
+@db_read
+def get_cached_response(key: str, min_created_at: float):
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT response FROM response_cache WHERE key = ? AND created_at >= ?",
+            (key, min_created_at)
+        ).fetchone()
+    return row[0] if row else None
+
+
+@db_write
+def save_cached_response(key: str, response: str, created_at: float):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO response_cache (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, created_at)
+        )
+
+
+@db_write
+def delete_expired_responses(min_created_at: float):
+    with transaction() as conn:
+        conn.execute("DELETE FROM response_cache WHERE created_at < ?", (min_created_at,))
@@ -0,0 +1,56 @@
+import html
+import re
+
+from app.config.database.db_config import get_connection
+from app.config.database.db_executor import db_read
+
+# Маркеры подсветки из символов частной области Unicode: их не бывает в тексте,
+# поэтому текст можно безопасно экранировать, а потом заменить маркеры на <mark>
+_HIGHLIGHT_START = ""
+_HIGHLIGHT_END = ""
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_match_query(query: str):
+    """Превращает пользовательский запрос в выражение FTS5: все слова обязательны, с поиском по префиксу"""
+    terms = _TERM_RE.findall(query)
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms[:16])
+
+
+def _render_snippet(snippet: str) -> str:
+    return html.escape(snippet).replace(_HIGHLIGHT_START, "<mark>").replace(_HIGHLIGHT_END, "</mark>")
+
+
+@db_read
+def search_messages(user_id: int, query: str, limit: int = 20, offset: int = 0):
+    match = build_match_query(query)
+    if match is None:
+        return [], False
+    with get_connection() as conn:
+        rows = conn.execute(
+            """
+            SELECT m.id, m.chat_id, c.name, c.chat_type, m.role, m.timestamp,
+                   snippet(messages_fts, 0, ?, ?, '…', 24),
+                   bm25(messages_fts, 1.0, 0.0) AS rank
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN chats c ON c.id = m.chat_id
+            WHERE messages_fts MATCH ?
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+            """,
+            (_HIGHLIGHT_START, _HIGHLIGHT_END, f"owner:u{int(user_id)} AND content:({match})", limit + 1, offset)
+        ).fetchall()
+    has_more = len(rows) > limit
+    return [{
+        "message_id": row[0],
+        "chat_id": row[1],
+        "chat_name": row[2],
+        "chat_type": row[3],
+        "role": row[4],
+        "timestamp": row[5],
+        "snippet": _render_snippet(row[6]),
+        "rank": row[7],
+    } for row in rows[:limit]], has_more
@@ -1,63 +1,120 @@
-from fastapi import Request
 import sqlite3
+import time
+
+from fastapi import Request
 
-from jose import jwt, JWTError
+from app.config.core.global_var import SECRET_KEY, ALGORITHM, AUTH_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL, \
+    AUTH_USER_CACHE_TTL
+from app.config.database.db_config import get_connection, transaction
+from app.config.database.db_executor import db_read, db_write
+from app.util.passwords import hash_password
+from app.util.shared_state import make_cache
 
-from app.config.core.config import pwd_context
-from app.config.core.global_var import SECRET_KEY, ALGORITHM
+# token -> username (sub) из уже проверенного JWT
+_token_cache = make_cache("auth_tokens", AUTH_CACHE_SIZE, AUTH_TOKEN_CACHE_TTL)
+# username -> данные пользователя без хэша пароля
+_user_cache = make_cache("auth_users", AUTH_CACHE_SIZE, AUTH_USER_CACHE_TTL)
 
 
 # Вспомогательные функции для работы с БД
+@db_read
 def get_user_by_username(username: str):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, email, hashed_password FROM users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        user = conn.execute(
+            "SELECT id, username, email, hashed_password FROM users WHERE username = ?", (username,)
+        ).fetchone()
     if user:
         return {"id": user[0], "username": user[1], "email": user[2], "hashed_password": user[3]}
     return None
 
 
+@db_read
+def get_public_user_by_username(username: str):
+    with get_connection() as conn:
+        user = conn.execute("SELECT id, username, email FROM users WHERE username = ?", (username,)).fetchone()
+    if user:
+        return {"id": user[0], "username": user[1], "email": user[2]}
+    return None
+
+
+@db_read
 def get_user_by_id(user_id: int):
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, username, email FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        user = conn.execute("SELECT id, username, email FROM users WHERE id = ?", (user_id,)).fetchone()
     if user:
         return {"id": user[0], "username": user[1], "email": user[2]}
     return None
 
 
-def create_user(username: str, email: str, password: str):
-    hashed_password = pwd_context.hash(password)
-    conn = sqlite3.connect('crm.db')
-    cursor = conn.cursor()
+@db_write
+def _insert_user(username: str, email: str, hashed_password: str):
     try:
-        cursor.execute(
-            "INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
-            (username, email, hashed_password)
-        )
-        conn.commit()
-        user_id = cursor.lastrowid
-        conn.close()
+        with transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
+                (username, email, hashed_password)
+            )
+            user_id = cursor.lastrowid
         return {"id": user_id, "username": username, "email": email}
     except sqlite3.IntegrityError:
-        conn.close()
         return None
 
 
-def get_current_user(request: Request):
-    token = request.cookies.get("access_token")
-    if not token:
-        return None
+async def create_user(username: str, email: str, password: str):
+    hashed_password = await hash_password(password)
+    user = await _insert_user(username, email, hashed_password)
+    if user:
+        invalidate_user(username)
+    return user
+
+
+def invalidate_user(username: str):
+    """Сбрасывает закэшированные данные пользователя (вызывать при любом их изменении)"""
+    _user_cache.delete(username)
+
+
+def invalidate_token(token: str):
+    """Сбрасывает закэшированный токен (при выходе пользователя)"""
+    _token_cache.delete(token)
+
+
+def auth_cache_stats():
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
+
+
+def _decode_username(token: str):
+    username = _token_cache.get(token)
+    if username is not None:
+        return username
+    from jose import jwt, JWTError
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        user = get_user_by_username(username)
-        return user
     except JWTError:
         return None
+    username = payload.get("sub")
+    if username is None:
+        return None
+    # Токен не должен жить в кэше дольше собственного срока действия
+    expires_in = payload["exp"] - time.time() if "exp" in payload else AUTH_TOKEN_CACHE_TTL
+    _token_cache.set(token, username, ttl=expires_in)
+    return username
+
+
+async def get_current_user(request: Request):
+    # Пользователь определяется один раз за запрос и сохраняется в request.state
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+
+    user = None
+    token = request.cookies.get("access_token")
+    username = _decode_username(token) if token else None
+    if username is not None:
+        user = _user_cache.get(username)
+        if user is None:
+            user = await get_public_user_by_username(username)
+            if user:
+                _user_cache.set(username, user)
+
+    request.state.current_user = user
+    return user
@@ -0,0 +1,112 @@
+import asyncio
+from typing import Callable, Optional, Tuple
+
+from app.ai_agent.context import build_context
+from app.config.core.global_var import CHAT_CACHE_SIZE, CHAT_CACHE_TTL
+from app.repositories.chat_repositories import get_chat_for_user, create_chat, clear_chat_history, add_message, \
+    get_user_chats
+from app.util.http_cache import make_etag, latest_timestamp
+from app.util.shared_state import make_cache
+
+# Ответ бота, если генерация прервалась до первого токена
+INTERRUPTED_REPLY = "Генерация ответа была прервана. Попробуйте отправить сообщение еще раз."
+
+# (user_id, chat_id) -> {"id", "user_id", "name", "chat_type"}
+_chat_cache = make_cache("chats", CHAT_CACHE_SIZE, CHAT_CACHE_TTL)
+# user_id -> {"chats", "etag", "last_modified"} — список чатов для панели управления
+_chat_list_cache = make_cache("chat_lists", CHAT_CACHE_SIZE, CHAT_CACHE_TTL)
+
+
+async def get_user_chat(chat_id: int, user_id: int) -> Optional[dict]:
+    """Метаданные чата, если он принадлежит пользователю; одна выборка из БД, дальше — из кэша"""
+    key = (user_id, chat_id)
+    chat = _chat_cache.get(key)
+    if chat is None:
+        chat = await get_chat_for_user(chat_id, user_id)
+        if chat:
+            _chat_cache.set(key, chat)
+    return chat
+
+
+async def get_user_chat_list(user_id: int) -> dict:
+    """Чаты пользователя вместе с ETag и временем последнего изменения списка; сбрасывается при создании чата"""
+    entry = _chat_list_cache.get(user_id)
+    if entry is None:
+        chats = await get_user_chats(user_id)
+        entry = {
+            "chats": chats,
+            "etag": make_etag(*((chat["id"], chat["name"], chat["chat_type"], chat["created_at"]) for chat in chats)),
+            "last_modified": latest_timestamp(chat["created_at"] for chat in chats),
+        }
+        _chat_list_cache.set(user_id, entry)
+    return entry
+
+
+async def create_user_chat(user_id: int, name: str, chat_type: str) -> int:
+    chat_id = await create_chat(user_id, name, chat_type)
+    # Сразу кладем метаданные в кэш: первый переход в новый чат не пойдет в БД
+    _chat_cache.set((user_id, chat_id), {"id": chat_id, "user_id": user_id, "name": name, "chat_type": chat_type})
+    invalidate_chat_list(user_id)
+    return chat_id
+
+
+async def clear_user_chat(chat_id: int, user_id: int):
+    await clear_chat_history(chat_id)
+    invalidate_chat(chat_id, user_id)
+
+
+def invalidate_chat(chat_id: int, user_id: int):
+    _chat_cache.delete((user_id, chat_id))
+
+
+def invalidate_chat_list(user_id: int):
+    _chat_list_cache.delete(user_id)
+
+
+def chat_cache_stats():
+    return {
+        "chats": _chat_cache.stats(),
+        "lists": _chat_list_cache.stats(),
+    }
+
+
+async def run_chat_turn(bot, chat: dict, message: str) -> str:
+    """Один ход диалога: контекст, сохранение сообщения пользователя, ответ модели и его сохранение"""
+    # Собираем историю в пределах окна контекста (до сохранения нового сообщения, чтобы не отправить его дважды)
+    history = await build_context(chat["id"], bot.prompts.get(chat["chat_type"]), message)
+
+    # Добавляем сообщение пользователя
+    await add_message(chat["id"], "user", message)
+
+    # Получаем ответ от ИИ агента
+    # (id чата — ключ сессии: модель продолжает диалог с сохраненного context)
+    bot_response = await bot.get_response(message, history, chat["chat_type"], session_key=chat["id"])
+
+    # Добавляем ответ бота
+    await add_message(chat["id"], "assistant", bot_response)
+    return bot_response
+
+
+async def stream_chat_turn(bot, chat: dict, message: str, on_token: Callable[[str], None]) -> Tuple[str, int]:
+    """
+    Ход диалога с потоковой выдачей: каждый токен ответа передается в on_token по мере генерации
+
+    Returns:
+        Ответ бота целиком и id сохраненного сообщения
+    """
+    history = await build_context(chat["id"], bot.prompts.get(chat["chat_type"]), message)
+    await add_message(chat["id"], "user", message)
+
+    parts = []
+    completed = False
+    try:
+        async for token in bot.stream_response(message, history, chat["chat_type"], session_key=chat["id"]):
+            parts.append(token)
+            on_token(token)
+        completed = True
+    finally:
+        # Ответ сохраняется и при прерванной генерации (отмена задания, ошибка), иначе в чате останется
+        # вопрос без ответа; shield не дает отмене задания прервать саму запись
+        bot_response = "".join(parts) if completed or parts else INTERRUPTED_REPLY
+        message_id = await asyncio.shield(add_message(chat["id"], "assistant", bot_response))
+    return bot_response, message_id
@@ -0,0 +1,187 @@
+import asyncio
+import gzip
+import json
+import zlib
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+from app.config.core.global_var import EXPORT_BATCH_SIZE, EXPORT_CHUNK_SIZE, EXPORT_GZIP_LEVEL, IMPORT_BATCH_SIZE
+from app.repositories.chat_repositories import get_user_chats_after, get_chat_messages_after, import_chat, \
+    import_messages
+from app.services.chat_service import invalidate_chat_list
+
+# Формат выгрузки: первая строка — заголовок, затем строка каждого чата и строки его сообщений
+EXPORT_FORMAT = "crm-chats"
+EXPORT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class ImportFormatError(ValueError):
+    """Строка файла импорта не разбирается или ссылается на неизвестный чат"""
+
+
+async def iter_user_records(user_id: int, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[dict]:
+    """
+    Все чаты и сообщения пользователя в виде записей выгрузки
+
+    Чаты и сообщения читаются keyset-пачками по batch_size строк, поэтому память не зависит
+    от объема истории. Выгрузка не является снимком: сообщения, добавленные во время обхода,
+    попадают в нее, если чат еще не пройден.
+    """
+    yield {"type": "export", "format": EXPORT_FORMAT, "version": EXPORT_VERSION}
+    after_chat_id = 0
+    while True:
+        chats = await get_user_chats_after(user_id, after_chat_id, batch_size)
+        for chat in chats:
+            yield {"type": "chat", **chat}
+            after_message_id = 0
+            while True:
+                messages = await get_chat_messages_after(chat["id"], after_message_id, batch_size)
+                for message in messages:
+                    yield {"type": "message", "chat_id": chat["id"], "role": message["role"],
+                           "content": message["content"], "timestamp": message["timestamp"]}
+                if len(messages) < batch_size:
+                    break
+                after_message_id = messages[-1]["id"]
+        if len(chats) < batch_size:
+            break
+        after_chat_id = chats[-1]["id"]
+
+
+async def export_chunks(user_id: int, compress: bool = False,
+                        chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """NDJSON-выгрузка пользователя кусками примерно по chunk_size байт (сжатыми gzip, если compress)"""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    size = 0
+    async for record in iter_user_records(user_id):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = b"".join(lines)
+            lines.clear()
+            size = 0
+            if compressor is not None:
+                # Компрессор может придержать данные до следующего куска — пустые куски не отправляем
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = b"".join(lines)
+    if compressor is not None:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def open_export(fileobj: BinaryIO) -> BinaryIO:
+    """Файл выгрузки для построчного чтения; gzip распознается по сигнатуре, а не по имени файла"""
+    if fileobj.read(2) == GZIP_MAGIC:
+        fileobj.seek(0)
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    fileobj.seek(0)
+    return fileobj
+
+
+def _parse_record(line: bytes, number: int) -> dict:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise ImportFormatError(f"Строка {number}: некорректный JSON ({e})")
+    if not isinstance(record, dict):
+        raise ImportFormatError(f"Строка {number}: ожидается объект JSON")
+    return record
+
+
+def _read_records(lines: Iterator[bytes], start: int, count: int) -> List[Tuple[int, dict]]:
+    """Следующие count непустых записей файла; пустой список — файл закончился"""
+    records = []
+    number = start
+    try:
+        for line in lines:
+            number += 1
+            if line.strip():
+                records.append((number, _parse_record(line, number)))
+                if len(records) >= count:
+                    break
+    except (OSError, EOFError, zlib.error) as e:
+        # Битый gzip или обрыв загрузки
+        raise ImportFormatError(f"Строка {number + 1}: файл поврежден ({e})")
+    return records
+
+
+def _field(record: dict, name: str, types: tuple, number: int, optional: bool = False):
+    # Значение поля нужного типа (bool в JSON — не число); optional допускает отсутствие и null
+    if optional and record.get(name) is None:
+        return None
+    value = record[name]
+    if isinstance(value, bool) or not isinstance(value, types):
+        raise ImportFormatError(f"Строка {number}: недопустимое значение поля {name!r}")
+    return value
+
+
+async def import_records(user_id: int, lines: Iterable[bytes], batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Импортирует выгрузку iter_user_records в чаты пользователя user_id
+
+    Каждый чат создается заново (id выдает эта база), сообщения пишутся пачками по batch_size
+    в одной транзакции, поэтому в памяти не больше одной пачки. Чтение, распаковка и разбор файла
+    идут в отдельном потоке, чтобы не блокировать event loop. Импорт не атомарен: при ошибке
+    в середине файла уже записанные чаты и сообщения остаются.
+
+    Returns:
+        Число созданных чатов и сообщений
+    """
+    chat_ids: Dict[int, int] = {}
+    pending = []
+    imported = {"chats": 0, "messages": 0}
+    lines = iter(lines)
+    number = 0
+
+    async def flush():
+        if pending:
+            await import_messages(pending)
+            imported["messages"] += len(pending)
+            pending.clear()
+
+    try:
+        while True:
+            records = await asyncio.to_thread(_read_records, lines, number, batch_size)
+            if not records:
+                break
+            for number, record in records:
+                await _import_record(user_id, record, number, chat_ids, pending, imported)
+                if len(pending) >= batch_size:
+                    await flush()
+        await flush()
+    finally:
+        if imported["chats"]:
+            invalidate_chat_list(user_id)
+    return imported
+
+
+async def _import_record(user_id: int, record: dict, number: int, chat_ids: Dict[int, int], pending: list,
+                         imported: Dict[str, int]):
+    # Поля проверяются до записи: неверный тип не должен оставить в базе пустой чат
+    kind = record.get("type")
+    try:
+        if kind == "export":
+            version = _field(record, "version", (int,), number, optional=True) or 0
+            if record.get("format") != EXPORT_FORMAT or version > EXPORT_VERSION:
+                raise ImportFormatError(f"Строка {number}: неподдерживаемый формат выгрузки")
+        elif kind == "chat":
+            source_id = _field(record, "id", (int, str), number)
+            created_at = _field(record, "created_at", (str,), number, optional=True)
+            chat_ids[source_id] = await import_chat(user_id, str(record["name"]), str(record["chat_type"]), [],
+                                                    created_at)
+            imported["chats"] += 1
+        elif kind == "message":
+            chat_id = chat_ids.get(_field(record, "chat_id", (int, str), number))
+            if chat_id is None:
+                raise ImportFormatError(f"Строка {number}: сообщение ссылается на неизвестный чат")
+            timestamp = _field(record, "timestamp", (str,), number, optional=True)
+            pending.append((chat_id, str(record["role"]), str(record["content"]), timestamp))
+        else:
+            raise ImportFormatError(f"Строка {number}: неизвестный тип записи {kind!r}")
+    except KeyError as e:
+        raise ImportFormatError(f"Строка {number}: нет поля {e}")
@@ -0,0 +1,67 @@
+import zlib
+from typing import Optional, Union
+
+from app.config.core.global_var import MESSAGE_COMPRESSION, MESSAGE_COMPRESSION_MIN_BYTES, \
+    MESSAGE_COMPRESSION_LEVEL
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен — без него используется zlib из стандартной библиотеки
+    zstandard = None
+
+# Сжатое сообщение хранится в messages.content как BLOB: байт-метка алгоритма + данные.
+# Несжатые сообщения остаются TEXT, поэтому старые и новые строки читаются одинаково.
+ZLIB_TAG = b"\x01"
+ZSTD_TAG = b"\x02"
+
+# Сжатие, которое экономит меньше 10%, не стоит распаковки при каждом чтении
+MIN_SAVING_RATIO = 0.9
+
+
+def _codec(name: str) -> Optional[str]:
+    if name == "zstd" and zstandard is None:
+        return "zlib"
+    return name if name in ("zlib", "zstd") else None
+
+
+class MessageCodec:
+    """Прозрачное сжатие текста сообщений длиннее порога"""
+
+    def __init__(self, algorithm: str = MESSAGE_COMPRESSION, min_bytes: int = MESSAGE_COMPRESSION_MIN_BYTES,
+                 level: int = MESSAGE_COMPRESSION_LEVEL):
+        self.algorithm = _codec(algorithm)
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        if self.algorithm is None or text is None:
+            return text
+        raw = text.encode("utf-8")
+        if len(raw) < self.min_bytes:
+            return text
+        if self.algorithm == "zstd":
+            packed = ZSTD_TAG + zstandard.ZstdCompressor(level=self.level).compress(raw)
+        else:
+            packed = ZLIB_TAG + zlib.compress(raw, self.level)
+        return packed if len(packed) < len(raw) * MIN_SAVING_RATIO else text
+
+
+def decode_content(value: Union[str, bytes, None]) -> Optional[str]:
+    """Возвращает текст сообщения независимо от того, как оно хранится"""
+    if not isinstance(value, bytes):
+        return value
+    tag, payload = value[:1], value[1:]
+    if tag == ZLIB_TAG:
+        return zlib.decompress(payload).decode("utf-8")
+    if tag == ZSTD_TAG:
+        if zstandard is None:
+            raise RuntimeError("Сообщение сжато zstd, но пакет zstandard не установлен")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return value.decode("utf-8")
+
+
+message_codec = MessageCodec()
+
+
+def encode_content(text: str) -> Union[str, bytes]:
+    return message_codec.encode(text)
@@ -0,0 +1,78 @@
+import calendar
+import hashlib
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterable, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+# Ответы зависят от пользователя: промежуточным кэшам хранить их нельзя, браузер перепроверяет по ETag
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """Слабый ETag по содержимому: тело страницы может отдаваться и в сжатом виде"""
+    digest = hashlib.sha1("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def parse_db_timestamp(value: Optional[str]) -> Optional[float]:
+    """Время из SQLite (CURRENT_TIMESTAMP, UTC) в секунды эпохи"""
+    if not value:
+        return None
+    try:
+        return float(calendar.timegm(time.strptime(value[:19], "%Y-%m-%d %H:%M:%S")))
+    except ValueError:
+        return None
+
+
+def latest_timestamp(values: Iterable[Optional[str]]) -> Optional[float]:
+    timestamps = [ts for ts in map(parse_db_timestamp, values) if ts is not None]
+    return max(timestamps) if timestamps else None
+
+
+def _opaque_tag(etag: str) -> str:
+    etag = etag.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение (RFC 9110, 13.1.2): префикс W/ и кавычки не учитываются"""
+    if header.strip() == "*":
+        return True
+    expected = _opaque_tag(etag)
+    return any(_opaque_tag(candidate) == expected for candidate in header.split(","))
+
+
+def weak_etag(etag: str) -> str:
+    return etag if etag.startswith("W/") else f'W/"{_opaque_tag(etag)}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """Условный GET: If-None-Match важнее If-Modified-Since, как требует RFC 9110"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def cache_headers(etag: str, last_modified: Optional[float] = None) -> dict:
+    headers = {"ETag": etag, "Cache-Control": PRIVATE_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified(etag: str, last_modified: Optional[float] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, last_modified))
@@ -0,0 +1,97 @@
+import gzip
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config.core.global_var import HTTP_COMPRESSION_MIN_SIZE, HTTP_GZIP_LEVEL, HTTP_BROTLI_QUALITY
+from app.util.http_cache import weak_etag
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен — без него отвечаем gzip
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript",
+                      "text/javascript", "image/svg+xml")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Выбирает br или gzip по заголовку Accept-Encoding (с учетом q=0)"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Сжимает ответы, тело которых приходит одним куском: HTML, JSON истории и сообщений, статику
+
+    Потоковые ответы (SSE с токенами модели, большие файлы) пропускаются как есть: сжатие
+    буферизовало бы токены и ломало бы вывод по мере генерации.
+    """
+
+    def __init__(self, app, minimum_size: int = HTTP_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Заголовки отправляем вместе с первым куском тела, когда станет ясно, сжимать ли его
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+            if (message.get("more_body", False) or len(body) < self.minimum_size
+                    or "content-encoding" in headers or media_type not in COMPRESSIBLE_TYPES):
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                # Сжатое представление побайтно отличается от исходного — сильный ETag становится слабым
+                headers["ETag"] = weak_etag(headers["etag"])
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
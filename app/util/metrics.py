@@ -0,0 +1,268 @@
+import bisect
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.config.core.global_var import SLOW_REQUEST_THRESHOLD_MS
+
+logger = logging.getLogger("crm.slow_requests")
+
+# Границы корзин гистограмм по умолчанию (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как в клиенте Prometheus"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> (счетчики по корзинам, сумма, количество)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((key, list(series[0]), series[1], series[2]) for key, series in self._series.items())
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class GaugeCallback:
+    """Значения, которые считываются в момент запроса /metrics (глубина очереди, соединения и т.п.)"""
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(self.func())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_duration = registry.register(Histogram(
+    "crm_http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status")
+))
+span_duration = registry.register(Histogram(
+    "crm_span_duration_seconds", "Время операций внутри запроса (запросы к БД, модель, шаблоны)", ("span",)
+))
+request_db_queries = registry.register(Histogram(
+    "crm_request_db_queries", "Число обращений к БД за один HTTP-запрос", ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+))
+request_db_time = registry.register(Histogram(
+    "crm_request_db_seconds", "Суммарное время обращений к БД за один HTTP-запрос", ("route",)
+))
+model_time_to_first_token = registry.register(Histogram(
+    "crm_model_time_to_first_token_seconds", "Время до первого токена ответа модели", ("model",)
+))
+model_tokens_per_second = registry.register(Histogram(
+    "crm_model_tokens_per_second", "Скорость генерации ответа модели", ("model",),
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 200, 500)
+))
+model_tokens = registry.register(Counter(
+    "crm_model_generated_tokens_total", "Число сгенерированных моделью токенов", ("model",)
+))
+
+
+class RequestTrace:
+    """Спаны одного HTTP-запроса; список пополняется и из потоков БД, поэтому под блокировкой"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float):
+        with self._lock:
+            self.spans.append((name, duration))
+
+    def db_summary(self) -> Tuple[int, float]:
+        with self._lock:
+            durations = [duration for name, duration in self.spans if name.startswith("db.")]
+        return len(durations), sum(durations)
+
+    def breakdown(self) -> str:
+        # Спаны одного имени сворачиваются: "db.get_user_chats 3x 4.2ms"
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            for name, duration in self.spans:
+                total = totals.setdefault(name, [0, 0.0])
+                total[0] += 1
+                total[1] += duration
+        parts = sorted(totals.items(), key=lambda item: -item[1][1])
+        return ", ".join(f"{name} {count}x {total * 1000:.1f}ms" for name, (count, total) in parts)
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace",
+                                                                                        default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def record_span(name: str, duration: float):
+    span_duration.observe(duration, span=name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, duration)
+
+
+@contextmanager
+def span(name: str):
+    """Замеряет блок кода и записывает его в гистограмму и в трассу текущего запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def record_generation(model: str, time_to_first_token: Optional[float], tokens: int, generation_time: float):
+    """Метрики одного ответа модели: время до первого токена и скорость генерации"""
+    if time_to_first_token is not None:
+        model_time_to_first_token.observe(time_to_first_token, model=model)
+    if tokens:
+        model_tokens.inc(tokens, model=model)
+        if generation_time > 0:
+            model_tokens_per_second.observe(tokens / generation_time, model=model)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: гистограмма задержки по шаблону маршрута и трасса спанов на каждый запрос
+
+    Задержка считается до конца отправки тела, поэтому потоковые ответы учитываются целиком.
+    Запросы дольше SLOW_REQUEST_THRESHOLD_MS пишутся в лог с разбивкой по спанам.
+    """
+
+    def __init__(self, app, slow_request_threshold_ms: float = SLOW_REQUEST_THRESHOLD_MS):
+        self.app = app
+        self.slow_request_threshold = slow_request_threshold_ms / 1000
+        self._route_paths = None
+
+    def _route_label(self, scope) -> str:
+        # После маршрутизации Starlette кладет в scope endpoint; по нему находим шаблон пути,
+        # чтобы в метках не было id чатов и число рядов не росло без ограничений
+        if self._route_paths is None:
+            paths = {}
+            for route in scope["app"].routes:
+                target = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                if target is not None:
+                    paths[target] = route.path if hasattr(route, "endpoint") else route.path + "/{path}"
+            self._route_paths = paths
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            elapsed = time.perf_counter() - trace.started
+            route = self._route_label(scope)
+            http_request_duration.observe(elapsed, method=scope["method"], route=route, status=status)
+            queries, db_time = trace.db_summary()
+            request_db_queries.observe(queries, route=route)
+            request_db_time.observe(db_time, route=route)
+            if self.slow_request_threshold and elapsed >= self.slow_request_threshold:
+                logger.warning("Медленный запрос %s %s -> %s за %.1f мс: %s", scope["method"], scope["path"],
+                               status, elapsed * 1000, trace.breakdown() or "нет спанов")
@@ -0,0 +1,36 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config.core.config import get_pwd_context
+from app.config.core.global_var import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING
+
+# bcrypt отпускает GIL, поэтому пул потоков разгружает event loop без накладных расходов на процессы
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+class PasswordHashingBusy(Exception):
+    """Очередь на хэширование переполнена — запрос нужно отклонить, а не ставить в очередь"""
+
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHashingBusy()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run(get_pwd_context().hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run(get_pwd_context().verify, plain_password, hashed_password)
+
+
+def password_pool_stats():
+    return {"workers": PASSWORD_HASH_WORKERS, "pending": _pending, "max_pending": PASSWORD_HASH_MAX_PENDING}
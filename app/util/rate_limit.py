@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Deque
+
+
+class RateLimiter:
+    """Скользящее окно: не более max_attempts попыток на ключ за window секунд"""
+
+    def __init__(self, max_attempts: int, window: float):
+        self.max_attempts = max_attempts
+        self.window = window
+        self._attempts: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = time.monotonic()
+
+    def _prune(self, attempts: Deque[float], now: float):
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+
+    def _cleanup(self, now: float):
+        # Периодически удаляем ключи без свежих попыток, чтобы словарь не рос бесконечно
+        if now - self._last_cleanup < self.window:
+            return
+        self._last_cleanup = now
+        for key in list(self._attempts):
+            attempts = self._attempts[key]
+            self._prune(attempts, now)
+            if not attempts:
+                del self._attempts[key]
+
+    def hit(self, key: str) -> bool:
+        """Регистрирует попытку; возвращает False, если лимит для ключа уже исчерпан"""
+        now = time.monotonic()
+        with self._lock:
+            self._cleanup(now)
+            attempts = self._attempts.setdefault(key, deque())
+            self._prune(attempts, now)
+            if len(attempts) >= self.max_attempts:
+                return False
+            attempts.append(now)
+            return True
+
+    def retry_after(self, key: str) -> int:
+        """Через сколько секунд для ключа освободится попытка"""
+        with self._lock:
+            attempts = self._attempts.get(key)
+            if not attempts:
+                return 0
+            return max(1, int(attempts[0] + self.window - time.monotonic()) + 1)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._attempts.pop(key, None)
@@ -1,5 +1,71 @@
-def read_prompt(filename):
-    file = open(f"app/prompt/{filename}.txt", 'r')
-    text = file.read()
-    file.close()
-    return text
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from app.config.core.global_var import PROMPT_RELOAD_INTERVAL
+from app.util.metrics import span
+
+# Путь считается от расположения модуля, а не от текущего каталога процесса
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts")
+DEFAULT_PROMPT = "default"
+
+
+def read_prompt(filename, directory=PROMPTS_DIR):
+    with open(os.path.join(directory, f"{filename}.txt"), 'r', encoding="utf-8") as file:
+        return file.read()
+
+
+class PromptRegistry:
+    """Системные промпты, загруженные в память один раз и перечитываемые при изменении файлов"""
+
+    def __init__(self, directory: str = PROMPTS_DIR, reload_interval: float = PROMPT_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._prompts: Dict[str, str] = {}
+        self._mtimes: Dict[str, int] = {}
+        self._last_check = float("-inf")
+        self._lock = threading.Lock()
+
+    def _scan(self) -> Dict[str, Tuple[str, int]]:
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".txt"):
+                    files[entry.name[:-4]] = (entry.path, entry.stat().st_mtime_ns)
+        return files
+
+    def load(self):
+        """Загружает все промпты каталога; перечитываются только изменившиеся файлы"""
+        with self._lock, span("prompts.load"):
+            files = self._scan()
+            prompts = {}
+            mtimes = {}
+            for name, (path, mtime) in files.items():
+                if self._mtimes.get(name) == mtime and name in self._prompts:
+                    prompts[name] = self._prompts[name]
+                else:
+                    prompts[name] = read_prompt(name, self.directory)
+                mtimes[name] = mtime
+            # Подменяем словари целиком, чтобы читатели никогда не видели частичного состояния
+            self._prompts = prompts
+            self._mtimes = mtimes
+            self._last_check = time.monotonic()
+
+    def _reload_if_stale(self):
+        if time.monotonic() - self._last_check < self.reload_interval:
+            return
+        try:
+            self.load()
+        except OSError:
+            # Каталог временно недоступен — продолжаем работать с уже загруженными промптами
+            self._last_check = time.monotonic()
+
+    def get(self, chat_type: str) -> str:
+        """Возвращает системный промпт для типа чата (или промпт по умолчанию)"""
+        self._reload_if_stale()
+        prompts = self._prompts
+        return prompts.get(chat_type) or prompts.get(DEFAULT_PROMPT, "")
+
+    def names(self):
+        return sorted(self._prompts)
@@ -0,0 +1,312 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Hashable, Optional, Tuple
+
+from app.config.core.global_var import SHARED_STATE_BACKEND, SHARED_STATE_PATH, SHARED_STATE_BUSY_TIMEOUT, \
+    SHARED_STATE_SYNC_INTERVAL, SHARED_STATE_INVALIDATION_RETENTION
+from app.util.cache import TTLCache
+from app.util.rate_limit import RateLimiter
+
+logger = logging.getLogger("crm.shared_state")
+
+# Как часто (в записях) удалять из kv строки с истекшим сроком
+PRUNE_EVERY = 256
+
+
+class SqliteStateStore:
+    """
+    Общее для всех процессов-воркеров хранилище в отдельном файле SQLite: лимиты входа, журнал
+    сбросов кэша и записи с ограниченным сроком жизни (kv, например состояние заданий модели)
+
+    Операции лимитера и kv короткие и выполняются в вызывающем потоке; таймаут блокировки маленький,
+    и при конкуренции операция считается неудачной, а не ждет секунды. Кэши в файл не ходят:
+    их сбросы копятся в памяти и отправляются фоновым потоком (см. SqliteCache).
+    """
+
+    def __init__(self, path: str = SHARED_STATE_PATH, busy_timeout: float = SHARED_STATE_BUSY_TIMEOUT,
+                 sync_interval: float = SHARED_STATE_SYNC_INTERVAL):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.sync_interval = sync_interval
+        self._local = threading.local()
+        # Отличает свои сбросы от чужих в общем журнале
+        self._origin = uuid.uuid4().hex
+        self._caches: Dict[str, TTLCache] = {}
+        self._outbox: Deque[Tuple[str, Optional[str], float]] = deque()
+        self._sync_thread: Optional[threading.Thread] = None
+        self._sync_lock = threading.Lock()
+        self._last_seen = 0
+        self._last_prune = 0.0
+        self._writes = 0
+        self.sync_errors = 0
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS kv (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS hits (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    ts REAL NOT NULL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_hits_key_ts ON hits (namespace, key, ts)")
+            # key IS NULL — сброс всего пространства имен
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS invalidations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    origin TEXT NOT NULL,
+                    namespace TEXT NOT NULL,
+                    key TEXT,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            # Сбросы, сделанные до запуска процесса, его пустых кэшей не касаются
+            self._last_seen = conn.execute("SELECT COALESCE(MAX(id), 0) FROM invalidations").fetchone()[0]
+
+    def connection(self) -> sqlite3.Connection:
+        # Одно соединение на поток: лимитер вызывается из пула потоков, журнал сбросов — из своего потока
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, namespace: str, key: str, value: Any, ttl: float) -> bool:
+        """Записывает значение, видимое всем воркерам; False, если хранилище занято или недоступно"""
+        now = time.time()
+        try:
+            conn = self.connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value, ensure_ascii=False), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+            return True
+        except sqlite3.Error as e:
+            logger.warning("Общее хранилище недоступно (%s): %s", namespace, e)
+            return False
+
+    def get(self, namespace: str, key: str) -> Any:
+        try:
+            row = self.connection().execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND expires_at > ?", (namespace, key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Общее хранилище недоступно (%s): %s", namespace, e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def register(self, namespace: str, cache: TTLCache):
+        """Подписывает кэш процесса на сбросы из других воркеров"""
+        self._caches[namespace] = cache
+        with self._sync_lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_loop, name="shared-state-sync", daemon=True)
+                self._sync_thread.start()
+
+    def publish(self, namespace: str, key: Optional[str]):
+        """Ставит сброс в очередь на отправку; не блокирует и не падает"""
+        self._outbox.append((namespace, key, time.time()))
+
+    def pending(self) -> int:
+        return len(self._outbox)
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                # Неотправленные сбросы остаются в очереди и уйдут при следующей попытке
+                self.sync_errors += 1
+                logger.warning("Журнал сбросов кэша недоступен: %s", e)
+
+    def sync(self):
+        """Отправляет накопленные сбросы и применяет к кэшам процесса сбросы других воркеров"""
+        conn = self.connection()
+        batch = list(self._outbox)
+        if batch:
+            conn.executemany(
+                "INSERT INTO invalidations (origin, namespace, key, created_at) VALUES (?, ?, ?, ?)",
+                [(self._origin, namespace, key, created_at) for namespace, key, created_at in batch]
+            )
+            for _ in batch:
+                self._outbox.popleft()
+
+        rows = conn.execute(
+            "SELECT id, origin, namespace, key FROM invalidations WHERE id > ? ORDER BY id", (self._last_seen,)
+        ).fetchall()
+        for row_id, origin, namespace, key in rows:
+            self._last_seen = row_id
+            cache = self._caches.get(namespace)
+            if origin == self._origin or cache is None:
+                continue
+            if key is None:
+                cache.clear()
+            else:
+                cache.delete(_decode_key(key))
+
+        now = time.time()
+        if now - self._last_prune >= SHARED_STATE_INVALIDATION_RETENTION:
+            self._last_prune = now
+            conn.execute("DELETE FROM invalidations WHERE created_at < ?", (now - SHARED_STATE_INVALIDATION_RETENTION,))
+
+
+def _encode_key(key: Hashable) -> str:
+    return json.dumps(key, ensure_ascii=False)
+
+
+def _decode_key(key: str) -> Hashable:
+    # Кортежные ключи, например (user_id, chat_id), после JSON становятся списками
+    def restore(value):
+        return tuple(restore(item) for item in value) if isinstance(value, list) else value
+    return restore(json.loads(key))
+
+
+class SqliteCache:
+    """
+    Кэш с интерфейсом TTLCache: данные в памяти процесса, сбросы рассылаются остальным воркерам
+
+    get и set не обращаются к файлу и не блокируют event loop. delete и clear сбрасывают запись
+    у себя сразу, а другим воркерам — в течение SHARED_STATE_SYNC_INTERVAL; до этого они могут
+    отдать устаревшее значение. Ошибка хранилища не роняет запрос: сброс будет отправлен повторно.
+    """
+
+    def __init__(self, store: SqliteStateStore, namespace: str, maxsize: int, ttl: float):
+        self.store = store
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = TTLCache(maxsize, ttl)
+        store.register(namespace, self._local)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._local.get(key, default)
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._local.set(key, value, ttl)
+
+    def delete(self, key: Hashable):
+        self._local.delete(key)
+        self.store.publish(self.namespace, _encode_key(key))
+
+    def clear(self):
+        self._local.clear()
+        self.store.publish(self.namespace, None)
+
+    def __len__(self):
+        return len(self._local)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            **self._local.stats(),
+            "pending_invalidations": self.store.pending(),
+            "sync_errors": self.store.sync_errors,
+        }
+
+
+class SqliteRateLimiter:
+    """Скользящее окно RateLimiter, общее для всех процессов"""
+
+    def __init__(self, store: SqliteStateStore, namespace: str, max_attempts: int, window: float):
+        self.store = store
+        self.namespace = namespace
+        self.max_attempts = max_attempts
+        self.window = window
+
+    def hit(self, key: str) -> bool:
+        """Регистрирует попытку; возвращает False, если лимит для ключа уже исчерпан"""
+        now = time.time()
+        try:
+            conn = self.store.connection()
+            # Проверка и запись в одной транзакции, чтобы параллельные воркеры не превысили лимит
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM hits WHERE namespace = ? AND key = ? AND ts <= ?",
+                             (self.namespace, key, now - self.window))
+                count = conn.execute("SELECT COUNT(*) FROM hits WHERE namespace = ? AND key = ?",
+                                     (self.namespace, key)).fetchone()[0]
+                allowed = count < self.max_attempts
+                if allowed:
+                    conn.execute("INSERT INTO hits (namespace, key, ts) VALUES (?, ?, ?)", (self.namespace, key, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return allowed
+        except sqlite3.Error as e:
+            # Хранилище недоступно — пропускаем попытку: вход важнее, пароль все равно проверяется
+            logger.warning("Общий лимитер %s недоступен: %s", self.namespace, e)
+            return True
+
+    def retry_after(self, key: str) -> int:
+        """Через сколько секунд для ключа освободится попытка"""
+        try:
+            row = self.store.connection().execute(
+                "SELECT MIN(ts) FROM hits WHERE namespace = ? AND key = ? AND ts > ?",
+                (self.namespace, key, time.time() - self.window)
+            ).fetchone()
+        except sqlite3.Error as e:
+            # Вызывается после отказа в попытке — называем худший срок, целое окно
+            logger.warning("Общий лимитер %s недоступен: %s", self.namespace, e)
+            return max(1, int(self.window))
+        if row[0] is None:
+            return 0
+        return max(1, int(row[0] + self.window - time.time()) + 1)
+
+    def reset(self, key: str):
+        try:
+            self.store.connection().execute("DELETE FROM hits WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as e:
+            # Вход уже состоялся; старые попытки сами выйдут из окна
+            logger.warning("Общий лимитер %s недоступен: %s", self.namespace, e)
+
+
+_store: Optional[SqliteStateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[SqliteStateStore]:
+    """Общее хранилище или None, если состояние хранится в памяти процесса"""
+    global _store
+    if SHARED_STATE_BACKEND == "memory":
+        return None
+    if SHARED_STATE_BACKEND != "sqlite":
+        raise ValueError(f"Неизвестный SHARED_STATE_BACKEND: {SHARED_STATE_BACKEND}")
+    with _store_lock:
+        if _store is None:
+            _store = SqliteStateStore()
+    return _store
+
+
+def make_cache(namespace: str, maxsize: int, ttl: float):
+    """Кэш в памяти процесса или общий для воркеров — в зависимости от SHARED_STATE_BACKEND"""
+    store = get_store()
+    if store is None:
+        return TTLCache(maxsize, ttl)
+    return SqliteCache(store, namespace, maxsize, ttl)
+
+
+def make_rate_limiter(namespace: str, max_attempts: int, window: float):
+    store = get_store()
+    if store is None:
+        return RateLimiter(max_attempts, window)
+    return SqliteRateLimiter(store, namespace, max_attempts, window)
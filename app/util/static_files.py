@@ -0,0 +1,74 @@
+import hashlib
+import os
+from typing import Dict
+
+from starlette.staticfiles import StaticFiles
+
+from app.util.http_cache import etag_matches
+
+# Путь считается от расположения модуля, а не от текущего каталога процесса
+STATIC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "static")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class HashedStaticFiles(StaticFiles):
+    """
+    Статика с хэшем содержимого в имени файла: css/chat.css -> css/chat.<хэш>.css
+
+    Манифест строится один раз при старте. Адреса с хэшем отдаются с заголовком immutable
+    и кэшируются браузером на год; после изменения файла меняется и адрес. Обычные адреса
+    по-прежнему работают, но браузер перепроверяет их по ETag при каждом использовании.
+    """
+
+    def __init__(self, directory: str = STATIC_DIR, prefix: str = "/static"):
+        super().__init__(directory=directory)
+        self.prefix = prefix
+        self.manifest: Dict[str, str] = {}
+        self._originals: Dict[str, str] = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                stem, ext = os.path.splitext(relative)
+                hashed = f"{stem}.{_file_hash(path)}{ext}"
+                self.manifest[relative] = hashed
+                self._originals[hashed] = relative
+        # Версия всего набора: меняется при изменении любого файла (используется в ETag страниц)
+        self.version = hashlib.sha256(
+            "\n".join(sorted(self.manifest.values())).encode("utf-8")
+        ).hexdigest()[:12]
+
+    def url(self, path: str) -> str:
+        """Адрес файла для шаблонов; для неизвестных файлов — обычный адрес без хэша"""
+        return f"{self.prefix}/{self.manifest.get(path, path)}"
+
+    def is_not_modified(self, response_headers, request_headers) -> bool:
+        # Starlette сравнивает ETag буквально; браузер же возвращает слабую версию,
+        # если файл был отдан сжатым, поэтому сравниваем слабо
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None and "etag" in response_headers:
+            return etag_matches(if_none_match, response_headers["etag"])
+        return super().is_not_modified(response_headers, request_headers)
+
+    async def get_response(self, path: str, scope):
+        original = self._originals.get(path.replace(os.sep, "/"))
+        if original is None:
+            response = await super().get_response(path, scope)
+            if response.status_code in (200, 304):
+                response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+            return response
+
+        response = await super().get_response(original, scope)
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -0,0 +1,108 @@
+"""
+Нагрузочный тест слоя БД: проверяет, что event loop остается отзывчивым,
+пока параллельно выполняется много записей.
+
+Запуск (из корня проекта):
+    python -m benchmarks.db_load --writers 64 --writes 50
+
+Для каждого числа параллельных писателей измеряется задержка "пробника" —
+короткой корутины, которая каждые несколько миллисекунд читает список чатов
+пользователя. Если база блокирует event loop, p99 задержки растет вместе
+с числом писателей; при выносе БД из event loop он должен оставаться ровным.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+async def run_round(writers: int, writes: int, chat_id: int, user_id: int):
+    from app.repositories.chat_repositories import add_message, get_user_chats
+
+    stop = asyncio.Event()
+    probe_samples = []
+    write_samples = []
+
+    async def probe():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await get_user_chats(user_id)
+            probe_samples.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+
+    async def writer(n):
+        for i in range(writes):
+            started = time.perf_counter()
+            await add_message(chat_id, "user", f"writer {n} message {i} " + "x" * 200)
+            write_samples.append(time.perf_counter() - started)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - started
+    if writers == 0:
+        await asyncio.sleep(0.5)
+    stop.set()
+    await probe_task
+
+    return {
+        "writers": writers,
+        "writes_per_writer": writes,
+        "writes_per_sec": round(writers * writes / elapsed, 1) if writers else 0.0,
+        "probe_latency": summarize(probe_samples),
+        "write_latency": summarize(write_samples),
+    }
+
+
+async def main(args):
+    from app.config.database.db_config import init_db, transaction
+    from app.config.database.db_executor import shutdown_executors
+
+    init_db()
+    with transaction() as conn:
+        user_id = conn.execute(
+            "INSERT INTO users (username, email, hashed_password) VALUES ('bench', 'bench@example.com', '-')"
+        ).lastrowid
+        chat_id = conn.execute(
+            "INSERT INTO chats (user_id, name, chat_type) VALUES (?, 'bench', 'default')", (user_id,)
+        ).lastrowid
+
+    results = []
+    for writers in [0] + [w for w in (1, 8, args.writers) if w <= args.writers]:
+        results.append(await run_round(writers, args.writes, chat_id, user_id))
+
+    shutdown_executors()
+    print(json.dumps({"benchmark": "db_load", "rounds": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--writers", type=int, default=64, help="максимальное число параллельных писателей")
+    parser.add_argument("--writes", type=int, default=50, help="записей на одного писателя")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию — временный файл)")
+    args = parser.parse_args()
+
+    # Путь к базе нужно задать до импорта модулей приложения
+    os.environ["CRM_DB_PATH"] = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    asyncio.run(main(args))
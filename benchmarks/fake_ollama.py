@@ -0,0 +1,142 @@
+"""
+Локальная заглушка Ollama для нагрузочных тестов.
+
+Запуск отдельно (из корня проекта):
+    python -m benchmarks.fake_ollama --port 11434 --latency 0.2 --tokens-per-sec 50
+
+Отвечает на /api/tags, /api/chat и /api/generate (обычный и потоковый режимы).
+Задержка до первого токена и скорость генерации задаются параметрами, поэтому
+результаты замеров не зависят от железа и загрузки настоящей модели.
+С --prompt-tokens-per-sec к задержке добавляется обработка промпта; токены
+из переданного context (/api/generate) считаются уже обработанными, как в KV-кэше.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPLY_WORDS = ("Хороший вопрос. Для начала определите целевую аудиторию, затем сформулируйте "
+               "ключевое предложение и выберите каналы продвижения с измеримыми целями.").split()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data: dict):
+        line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "fake"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path not in ("/api/chat", "/api/generate"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        tokens = [word + " " for word in (REPLY_WORDS * (server.tokens // len(REPLY_WORDS) + 1))[:server.tokens]]
+        token_delay = 1.0 / server.tokens_per_sec if server.tokens_per_sec > 0 else 0.0
+        # Грубая оценка: 4 символа на токен; обрабатывается только то, чего нет в context
+        prompt_text = request.get("system", "") + request.get("prompt", "") + \
+            "".join(msg.get("content", "") for msg in request.get("messages", []))
+        prompt_tokens = max(1, len(prompt_text) // 4)
+        prompt_delay = prompt_tokens / server.prompt_tokens_per_sec if server.prompt_tokens_per_sec > 0 else 0.0
+        time.sleep(server.latency + prompt_delay)
+
+        def piece(token: str) -> dict:
+            if self.path == "/api/generate":
+                return {"response": token}
+            return {"message": {"role": "assistant", "content": token}}
+
+        final = {"done": True, "eval_count": len(tokens), "prompt_eval_count": prompt_tokens}
+        if self.path == "/api/generate":
+            final["context"] = list(request.get("context", [])) + list(range(prompt_tokens + len(tokens)))
+
+        if not request.get("stream", True):
+            time.sleep(token_delay * len(tokens))
+            self._send_json({**piece("".join(tokens)), **final})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self._send_chunk({**piece(token), "done": False})
+            time.sleep(token_delay)
+        self._send_chunk({**piece(""), **final})
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOllama:
+    """HTTP-сервер в фоновом потоке с настраиваемой задержкой и скоростью генерации"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05,
+                 tokens_per_sec: float = 200.0, tokens: int = 40, prompt_tokens_per_sec: float = 0.0):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._server.tokens_per_sec = tokens_per_sec
+        self._server.tokens = tokens
+        self._server.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self._server.requests = 0
+        self._server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка до первого токена, с")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="скорость генерации (0 — без задержки)")
+    parser.add_argument("--tokens", type=int, default=40, help="длина ответа в токенах")
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=0.0,
+                        help="скорость обработки промпта (0 — без задержки)")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.host, args.port, args.latency, args.tokens_per_sec, args.tokens,
+                      args.prompt_tokens_per_sec)
+    print(f"Заглушка Ollama слушает {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,91 @@
+"""
+Пропускная способность входа при параллельной нагрузке.
+
+Запуск (из корня проекта):
+    python -m benchmarks.login_throughput --users 32 --concurrency 16 --rounds 4
+
+Регистрирует пользователей, затем выполняет логины с заданным параллелизмом
+и одновременно опрашивает легкую страницу /login/. Если bcrypt выполняется
+в event loop, задержка пробника растет до сотен миллисекунд; при выносе
+хэширования в пул потоков она должна оставаться малой.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.db_load import summarize
+
+
+async def main(args):
+    import httpx
+
+    from main import app
+    from app.config.database.db_config import init_db
+    from app.config.database.db_executor import shutdown_executors
+
+    # Замеряется только вход, поэтому из lifespan нужна лишь схема БД
+    init_db()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        usernames = [f"bench{i}" for i in range(args.users)]
+        for username in usernames:
+            await client.post("/register/", data={
+                "username": username, "email": f"{username}@example.com", "password": "password"
+            })
+
+        login_samples = []
+        probe_samples = []
+        failures = 0
+        stop = asyncio.Event()
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def login(username):
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/login/", data={"username": username, "password": "password"})
+                login_samples.append(time.perf_counter() - started)
+                if response.status_code != 303:
+                    failures += 1
+
+        async def probe():
+            while not stop.is_set():
+                started = time.perf_counter()
+                await client.get("/login/")
+                probe_samples.append(time.perf_counter() - started)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login(username) for _ in range(args.rounds) for username in usernames))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+    shutdown_executors()
+    print(json.dumps({
+        "benchmark": "login_throughput",
+        "logins": len(login_samples),
+        "failures": failures,
+        "concurrency": args.concurrency,
+        "logins_per_sec": round(len(login_samples) / elapsed, 1),
+        "login_latency": summarize(login_samples),
+        "probe_latency": summarize(probe_samples),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=4, help="сколько раз войти каждым пользователем")
+    args = parser.parse_args()
+
+    # Настройки нужно задать до импорта приложения; лимитер входа для замера отключаем
+    os.environ["CRM_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", "1000000")
+    os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_IP", "1000000")
+    asyncio.run(main(args))
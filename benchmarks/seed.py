@@ -0,0 +1,94 @@
+"""
+Заполнение синтетической базы для нагрузочных тестов.
+
+Запуск (из корня проекта):
+    python -m benchmarks.seed --scale medium --db /tmp/bench.db
+
+Создает пользователей bench0..benchN (пароль "password"), у каждого несколько
+чатов с историей сообщений. Размеры наборов — в SCALES; large дает около
+миллиона сообщений и заполняется несколько минут (вместе с поисковым индексом).
+"""
+import argparse
+import os
+import random
+import time
+
+# Пользователей, чатов на пользователя, сообщений в чате
+SCALES = {
+    "small": (10, 5, 20),
+    "medium": (100, 10, 100),
+    "large": (1000, 10, 100),
+}
+
+CHAT_TYPES = ["analysis", "strategy", "content", "ads", "seo", "social"]
+PASSWORD = "password"
+
+WORDS = ("маркетинг стратегия контент реклама бюджет аудитория бренд воронка продажи конверсия "
+         "лид трафик сайт поиск клиент рынок анализ отчет кампания охват публикация сегмент "
+         "позиционирование конкурент метрика тестирование рассылка блог видео партнер").split()
+
+
+def username(index: int) -> str:
+    return f"bench{index}"
+
+
+def seed(scale: str = "small", seed_value: int = 1) -> dict:
+    """Заполняет базу по пути из CRM_DB_PATH и возвращает сводку"""
+    from app.config.core.config import get_pwd_context
+    from app.config.database.db_config import init_db, transaction
+
+    users, chats_per_user, messages_per_chat = SCALES[scale]
+    rnd = random.Random(seed_value)
+    started = time.perf_counter()
+
+    init_db()
+    # bcrypt медленный — один хэш на всех пользователей
+    hashed_password = get_pwd_context().hash(PASSWORD)
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO users (username, email, hashed_password) VALUES (?, ?, ?)",
+            [(username(i), f"{username(i)}@example.com", hashed_password) for i in range(users)]
+        )
+        user_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM users WHERE username LIKE 'bench%' ORDER BY id"
+        )]
+        conn.executemany(
+            "INSERT INTO chats (user_id, name, chat_type) VALUES (?, ?, ?)",
+            [(user_id, f"Чат {n + 1}", rnd.choice(CHAT_TYPES))
+             for user_id in user_ids for n in range(chats_per_user)]
+        )
+        chat_ids = [row[0] for row in conn.execute(
+            "SELECT c.id FROM chats c JOIN users u ON u.id = c.user_id WHERE u.username LIKE 'bench%' ORDER BY c.id"
+        )]
+
+    def messages(batch):
+        for chat_id in batch:
+            for n in range(messages_per_chat):
+                yield chat_id, "user" if n % 2 == 0 else "assistant", " ".join(rnd.choices(WORDS, k=rnd.randint(8, 60)))
+
+    # Сообщения пишем пачками, чтобы не держать одну огромную транзакцию
+    for offset in range(0, len(chat_ids), 500):
+        with transaction() as conn:
+            conn.executemany("INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                             messages(chat_ids[offset:offset + 500]))
+
+    return {
+        "scale": scale,
+        "users": users,
+        "chats": len(chat_ids),
+        "messages": len(chat_ids) * messages_per_chat,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--db", required=True, help="путь к новой базе")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        parser.error(f"{args.db} уже существует")
+    # Путь к базе нужно задать до импорта модулей приложения
+    os.environ["CRM_DB_PATH"] = args.db
+    print(seed(args.scale))
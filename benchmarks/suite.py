@@ -0,0 +1,185 @@
+"""
+Нагрузочный набор для основных сценариев: вход, панель управления, история и сообщения.
+
+Запуск (из корня проекта):
+    python -m benchmarks.suite --scale small --concurrency 16 --requests 400 --output report.json
+    python -m benchmarks.suite --scale medium --baseline report.json
+
+Заполняет временную базу (см. benchmarks.seed), поднимает заглушку Ollama
+(см. benchmarks.fake_ollama) и гоняет приложение main.app в том же процессе
+через ASGI-транспорт httpx. Каждый сценарий выполняется параллельно
+--concurrency клиентами, затем идет смешанный сценарий. Результат — JSON
+с пропускной способностью и p50/p95/p99 задержки; с --baseline к каждому
+сценарию добавляется сравнение с прошлым отчетом.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from benchmarks.db_load import summarize
+from benchmarks.fake_ollama import FakeOllama
+from benchmarks.seed import SCALES, PASSWORD, seed, username
+
+# Доля запросов каждого типа в смешанном сценарии
+MIXED_WEIGHTS = {"dashboard": 4, "history": 4, "message": 1, "login": 1}
+
+
+class VirtualUser:
+    """Отдельный клиент со своими cookie, вошедший под одним из тестовых пользователей"""
+
+    def __init__(self, client, name: str, chat_ids):
+        self.client = client
+        self.name = name
+        self.chat_ids = chat_ids
+        self.rnd = random.Random(name)
+
+    async def login(self):
+        response = await self.client.post("/login/", data={"username": self.name, "password": PASSWORD})
+        return response, 303
+
+    async def dashboard(self):
+        return await self.client.get("/chat/dashboard"), 200
+
+    async def history(self):
+        chat_id = self.rnd.choice(self.chat_ids)
+        return await self.client.get(f"/chat/chat/{chat_id}/history"), 200
+
+    async def message(self):
+        chat_id = self.rnd.choice(self.chat_ids)
+        text = f"Как увеличить продажи? Вариант {self.rnd.randint(1, 10 ** 6)}"
+        return await self.client.post(f"/chat/chat/{chat_id}/message", data={"message": text}), 200
+
+
+async def run_scenario(users, scenario: str, requests: int) -> dict:
+    samples = []
+    errors = 0
+    remaining = requests
+
+    async def worker(user: VirtualUser):
+        nonlocal remaining, errors
+        names = list(MIXED_WEIGHTS)
+        weights = list(MIXED_WEIGHTS.values())
+        while remaining > 0:
+            remaining -= 1
+            name = user.rnd.choices(names, weights)[0] if scenario == "mixed" else scenario
+            started = time.perf_counter()
+            response, expected = await getattr(user, name)()
+            samples.append(time.perf_counter() - started)
+            if response.status_code != expected:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(user) for user in users))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 1),
+        "latency": summarize(samples),
+    }
+
+
+def compare(report: dict, baseline: dict):
+    # Отношение новое/старое: > 1 по задержке или < 1 по пропускной способности — регрессия
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        result["vs_baseline"] = {
+            "throughput_ratio": round(result["throughput_rps"] / old["throughput_rps"], 3)
+            if old["throughput_rps"] else None,
+            "p95_ratio": round(result["latency"]["p95_ms"] / old["latency"]["p95_ms"], 3)
+            if old["latency"]["p95_ms"] else None,
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args, seed_summary: dict, fake: FakeOllama) -> dict:
+    import httpx
+
+    from main import app
+
+    with sqlite3.connect(os.environ["CRM_DB_PATH"]) as conn:
+        chats = {}
+        for user_id, name, chat_id in conn.execute(
+                "SELECT u.id, u.username, c.id FROM users u JOIN chats c ON c.user_id = u.id ORDER BY c.id"):
+            chats.setdefault(name, []).append(chat_id)
+
+    scenarios = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        clients = [httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None)
+                   for _ in range(args.concurrency)]
+        users = []
+        for index, client in enumerate(clients):
+            name = username(index % seed_summary["users"])
+            user = VirtualUser(client, name, chats[name])
+            await user.login()
+            users.append(user)
+
+        for scenario in args.scenarios:
+            scenarios[scenario] = await run_scenario(users, scenario, args.requests)
+
+        for client in clients:
+            await client.aclose()
+
+    return {
+        "benchmark": "suite",
+        "commit": git_commit(),
+        "seed": seed_summary,
+        "concurrency": args.concurrency,
+        "fake_ollama": {
+            "latency_sec": args.latency,
+            "tokens_per_sec": args.tokens_per_sec,
+            "tokens": args.tokens,
+            "requests": fake.requests,
+        },
+        "scenarios": scenarios,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="запросов на сценарий")
+    parser.add_argument("--scenarios", nargs="+", default=["login", "dashboard", "history", "message", "mixed"],
+                        choices=["login", "dashboard", "history", "message", "mixed"])
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка заглушки Ollama до первого токена, с")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--output", help="куда сохранить отчет")
+    parser.add_argument("--baseline", help="прошлый отчет для сравнения")
+    args = parser.parse_args()
+
+    fake = FakeOllama(latency=args.latency, tokens_per_sec=args.tokens_per_sec, tokens=args.tokens).start()
+
+    # Настройки нужно задать до импорта приложения; лимитеры входа для замера отключаем
+    os.environ["CRM_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["OLLAMA_BACKENDS"] = fake.url
+    os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_ACCOUNT", "1000000")
+    os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_IP", "1000000")
+
+    report = asyncio.run(main(args, seed(args.scale), fake))
+    fake.stop()
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,27 @@
+# Запуск под gunicorn:  gunicorn -c gunicorn.conf.py main:app
+# (нужны пакеты gunicorn и uvicorn; число воркеров — WEB_CONCURRENCY)
+import os
+
+bind = f"{os.getenv('WEB_HOST', '127.0.0.1')}:{os.getenv('WEB_PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Приложение импортируется в каждом воркере: у каждого свой event loop, HTTP-клиент и потоки БД
+preload_app = False
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Миграции применяются один раз в главном процессе до запуска воркеров. Воркеры получают модули
+    # главного процесса через fork, поэтому флаг выставляется до первого импорта app.*, а пул
+    # соединений закрывается: открытые соединения SQLite нельзя использовать после fork
+    os.environ["CRM_INIT_DB"] = "0"
+    from app.config.database.db_config import init_db, close_pool
+
+    init_db()
+    close_pool()
+
+    from app.config.core.global_var import SHARED_STATE_BACKEND
+
+    if workers > 1 and SHARED_STATE_BACKEND == "memory":
+        server.log.warning("SHARED_STATE_BACKEND=memory: кэши, лимиты входа и задания /chat/jobs у каждого "
+                           "воркера свои; для общего состояния задайте SHARED_STATE_BACKEND=sqlite")
@@ -1,24 +1,35 @@
-from starlette.responses import RedirectResponse
+from app.config.core.application import create_app
 
-from app.config.core.config import app
-from app.controllers.chat import router as chat_router
-from app.controllers.authorization.login import router as login_router
-from app.controllers.authorization.logout import router as logout_router
-from app.controllers.authorization.register import router as register_router
+# Приложение собирается фабрикой; БД, клиент модели и очередь заданий готовятся в lifespan
+app = create_app()
 
-# Подключаем контроллеры
-app.include_router(chat_router)
-app.include_router(login_router)
-app.include_router(logout_router)
-app.include_router(register_router)
 
+if __name__ == "__main__":
+    import argparse
+    import os
 
-@app.get("/")
-def home_page():
-    return RedirectResponse(url="/login")
+    import uvicorn
 
+    from app.config.core.global_var import WEB_WORKERS, WEB_HOST, WEB_PORT, SHARED_STATE_BACKEND
 
-if __name__ == "__main__":
-    import uvicorn
+    parser = argparse.ArgumentParser(description="Marketing AI Agent CRM")
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="число процессов-воркеров")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        uvicorn.run(app, host=args.host, port=args.port)
+    else:
+        # Миграции один раз в главном процессе; воркеры (отдельные процессы, которые заново импортируют
+        # main:app) читают CRM_INIT_DB=0 и стартуют с уже актуальной схемой
+        from app.config.database.db_config import init_db, close_pool
 
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+        init_db()
+        close_pool()
+        os.environ["CRM_INIT_DB"] = "0"
+        if SHARED_STATE_BACKEND == "memory":
+            print("Внимание: SHARED_STATE_BACKEND=memory — кэши, лимиты входа и задания /chat/jobs у каждого "
+                  "воркера свои (опрос задания должен попасть в принявший его процесс); "
+                  "для общего состояния задайте SHARED_STATE_BACKEND=sqlite")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,115 @@
+"""
+Служебные команды для обслуживания базы.
+
+Запуск (из корня проекта):
+    python manage.py fts-backfill
+    python manage.py compress-messages --algorithm zlib
+    python manage.py export-chats --user alice --gzip -o alice.ndjson.gz
+    python manage.py import-chats --user bob alice.ndjson.gz
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from app.config.core.global_var import MESSAGE_COMPRESSION_MIN_BYTES, MESSAGE_COMPRESSION_LEVEL, IMPORT_BATCH_SIZE
+from app.config.database.db_config import init_db, rebuild_search_index, get_connection
+from app.repositories.chat_repositories import recode_messages
+from app.repositories.user_repositories import get_user_by_username
+from app.services.export_service import export_chunks, import_records, open_export
+from app.util.compression import MessageCodec
+
+
+def fts_backfill(args):
+    # Миграции сами заполняют индекс; команда нужна для восстановления, если он разошелся с сообщениями
+    init_db()
+    started = time.perf_counter()
+    rebuild_search_index()
+    print(f"Поисковый индекс перестроен за {time.perf_counter() - started:.1f} с")
+
+
+def compress_messages(args):
+    # algorithm none распаковывает все ранее сжатые сообщения
+    init_db()
+    codec = MessageCodec(args.algorithm, args.min_bytes, args.level)
+    started = time.perf_counter()
+    after_id, changed = 0, 0
+    while True:
+        after_id, batch_changed = recode_messages.sync(after_id, args.batch, codec)
+        if after_id is None:
+            break
+        changed += batch_changed
+    print(f"Изменено сообщений: {changed} за {time.perf_counter() - started:.1f} с")
+
+    if args.vacuum:
+        # Освободившиеся после сжатия страницы возвращаются файловой системе только после VACUUM
+        with get_connection() as conn:
+            conn.execute("VACUUM")
+        print("Файл базы уплотнен")
+
+
+def _get_user(username: str) -> dict:
+    user = get_user_by_username.sync(username)
+    if user is None:
+        sys.exit(f"Пользователь {username} не найден")
+    return user
+
+
+def export_chats(args):
+    init_db()
+    user = _get_user(args.user)
+
+    async def run(output):
+        async for chunk in export_chunks(user["id"], args.gzip):
+            output.write(chunk)
+
+    if args.output == "-":
+        asyncio.run(run(sys.stdout.buffer))
+    else:
+        with open(args.output, "wb") as output:
+            asyncio.run(run(output))
+
+
+def import_chats(args):
+    init_db()
+    user = _get_user(args.user)
+    started = time.perf_counter()
+    with open(args.input, "rb") as file:
+        imported = asyncio.run(import_records(user["id"], open_export(file), args.batch))
+    print(f"Импортировано чатов: {imported['chats']}, сообщений: {imported['messages']} "
+          f"за {time.perf_counter() - started:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("fts-backfill", help="заполнить полнотекстовый индекс по существующим сообщениям") \
+        .set_defaults(func=fts_backfill)
+
+    compress = commands.add_parser("compress-messages", help="сжать (или распаковать) сохраненные сообщения")
+    compress.add_argument("--algorithm", choices=["zlib", "zstd", "none"], default="zlib")
+    compress.add_argument("--min-bytes", type=int, default=MESSAGE_COMPRESSION_MIN_BYTES)
+    compress.add_argument("--level", type=int, default=MESSAGE_COMPRESSION_LEVEL)
+    compress.add_argument("--batch", type=int, default=1000, help="сообщений на транзакцию")
+    compress.add_argument("--vacuum", action="store_true", help="уплотнить файл базы после пересохранения")
+    compress.set_defaults(func=compress_messages)
+
+    export = commands.add_parser("export-chats", help="выгрузить все чаты пользователя в NDJSON")
+    export.add_argument("--user", required=True, help="имя пользователя")
+    export.add_argument("--gzip", action="store_true", help="сжать выгрузку gzip")
+    export.add_argument("-o", "--output", default="-", help="файл выгрузки (по умолчанию stdout)")
+    export.set_defaults(func=export_chats)
+
+    load = commands.add_parser("import-chats", help="загрузить выгрузку export-chats в чаты пользователя")
+    load.add_argument("--user", required=True, help="имя пользователя, которому добавляются чаты")
+    load.add_argument("--batch", type=int, default=IMPORT_BATCH_SIZE, help="сообщений на транзакцию")
+    load.add_argument("input", help="файл выгрузки (NDJSON или gzip)")
+    load.set_defaults(func=import_chats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
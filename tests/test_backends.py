@@ -0,0 +1,158 @@
+import asyncio
+import os
+import socket
+import tempfile
+import time
+
+import httpx
+import pytest
+
+# Модули приложения читают настройки при импорте: база и кэш ответов не должны трогать crm.db
+os.environ.setdefault("CRM_DB_PATH", os.path.join(tempfile.mkdtemp(), "crm.db"))
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+from app.ai_agent.backends import BackendRouter  # noqa: E402
+from app.ai_agent.interaction import MarketingAIBot  # noqa: E402
+from benchmarks.fake_ollama import FakeOllama  # noqa: E402
+
+RESET_TIMEOUT = 0.3
+PAYLOAD = {"model": "test", "prompt": "Привет", "stream": False}
+
+
+def refused_url() -> str:
+    # Порт свободен (сокет закрыт), поэтому соединение отклоняется сразу
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture
+def fake():
+    server = FakeOllama(latency=0.05, tokens_per_sec=0).start()
+    yield server
+    server.stop()
+
+
+def make_bot(urls):
+    bot = MarketingAIBot()
+    bot.router = BackendRouter(urls, failure_threshold=1, reset_timeout=RESET_TIMEOUT, health_check_interval=0)
+    return bot
+
+
+async def post(bot, client, count=1):
+    results = await asyncio.gather(*(bot._post(client, "/api/generate", PAYLOAD) for _ in range(count)))
+    return [response for response, _ in results]
+
+
+def test_failover_circuit_open_and_half_open(fake):
+    bot = make_bot([refused_url(), fake.url])
+    dead, alive = bot.router.backends
+
+    async def scenario():
+        async with httpx.AsyncClient(timeout=5) as client:
+            # Неизвестные задержки равны — первым пробуется недоступный сервер, запрос уходит на живой
+            responses = await post(bot, client)
+            assert [r.status_code for r in responses] == [200]
+            assert dead.failures == 1 and alive.requests == 1
+            assert dead.stats(time.monotonic(), RESET_TIMEOUT)["circuit"] == "open"
+
+            # Цепь разомкнута: к недоступному серверу запросы не идут
+            responses = await post(bot, client, 3)
+            assert [r.status_code for r in responses] == [200] * 3
+            assert dead.requests == 1
+
+            # После reset_timeout из параллельных запросов к серверу идет ровно один пробный
+            await asyncio.sleep(RESET_TIMEOUT)
+            assert dead.stats(time.monotonic(), RESET_TIMEOUT)["circuit"] == "half-open"
+            responses = await post(bot, client, 4)
+            assert [r.status_code for r in responses] == [200] * 4
+            assert dead.requests == 2
+            assert not dead.probing
+            assert dead.stats(time.monotonic(), RESET_TIMEOUT)["circuit"] == "open"
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_success_closes_circuit(fake):
+    bot = make_bot([fake.url])
+    backend = bot.router.backends[0]
+    backend.record_failure(bot.router.failure_threshold)
+    backend.opened_at -= RESET_TIMEOUT
+
+    async def scenario():
+        async with httpx.AsyncClient(timeout=5) as client:
+            probe = asyncio.create_task(bot._post(client, "/api/generate", PAYLOAD))
+            await asyncio.sleep(0.01)
+            # Пока идет пробный запрос, других серверов нет — второй запрос не пропускается
+            assert backend.probing
+            with pytest.raises(httpx.ConnectError):
+                await bot._post(client, "/api/generate", PAYLOAD)
+            response, url = await probe
+            assert response.status_code == 200 and url == fake.url
+        assert backend.opened_at is None and not backend.probing
+
+    asyncio.run(scenario())
+
+
+def test_unknown_latency_sorted_last(fake):
+    router = BackendRouter([refused_url(), fake.url], health_check_interval=0)
+    dead, alive = router.backends
+    alive.record_success(0.5)
+    assert router.candidates() == [alive, dead]
+
+
+def test_session_prefers_backend_with_its_context():
+    first = FakeOllama(latency=0.01, tokens_per_sec=0).start()
+    second = FakeOllama(latency=0.01, tokens_per_sec=0).start()
+    bot = make_bot([first.url, second.url])
+    a, b = bot.router.backends
+
+    async def turn(history, message):
+        reply = await bot.get_response(message, history, "seo", session_key=1)
+        return history + [{"role": "user", "content": message}, {"role": "assistant", "content": reply}]
+
+    async def scenario():
+        await bot.start()
+        try:
+            history = await turn([], "Первый вопрос")
+            assert bot.sessions._data[1].backend == first.url
+
+            # Второй сервер стал быстрее, но диалог продолжается там, где лежит его context
+            a.latency_ewma, b.latency_ewma = 1.0, 0.001
+            history = await turn(history, "Второй вопрос")
+            assert (first.requests, second.requests) == (2, 0)
+
+            # Сервер сессии недоступен — ход уходит на другой, и сессия переезжает вместе с ним
+            a.record_failure(bot.router.failure_threshold)
+            await turn(history, "Третий вопрос")
+            assert (first.requests, second.requests) == (2, 1)
+            assert bot.sessions._data[1].backend == second.url
+        finally:
+            await bot.close()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_single_failed_health_check_keeps_backend(fake):
+    router = BackendRouter([fake.url], health_check_interval=0, health_failure_threshold=2)
+    backend = router.backends[0]
+
+    async def scenario():
+        async with httpx.AsyncClient(timeout=5) as client:
+            backend.url = refused_url()
+            await router.check_health(client)
+            assert backend.healthy and router.candidates() == [backend]
+            await router.check_health(client)
+            assert not backend.healthy and router.candidates() == []
+
+            # Одна успешная проверка возвращает сервер и сбрасывает счетчик
+            backend.url = fake.url
+            await router.check_health(client)
+            assert backend.healthy and backend.health_failures == 0
+
+    asyncio.run(scenario())